@@ -0,0 +1,282 @@
+import argparse, os, fnmatch, json, importlib.util
+import numpy as np
+import pandas as pd
+
+# Joins the play data, ball receivers, defender stats and clusters into one
+# play / defender table. The table is saved by column, sorted on the keys,
+# with an index giving the rows of every play
+
+STATS_PREFIX = "week"
+STORE_PREFIX = "store"
+TABLE_NAME = "defenders"
+INDEX_NAME = "plays"
+PLAY_FILE = "plays.csv"
+X_FILE = "x.csv"
+Y_PREFIX = "y-"
+NORMALIZE_FILE = "normalizer.json"
+DATAFRAMES_SCRIPT = "generate-dataframes.py"
+INDEX_COL = "Unnamed: 0"
+
+GAME_COL = "gameId"
+PLAY_COL = "playId"
+PLAYER_COL = "nflId"
+PLAY_KEYS = [GAME_COL, PLAY_COL]
+KEYS = [GAME_COL, PLAY_COL, PLAYER_COL]
+START_COL = "start"
+END_COL = "end"
+
+BR_RANK_COL = "rank"
+BR_COLS = {
+	"receiver": "receiver",
+	"def_0": "receiver_defendent",
+	"diff": "receiver_diff"
+}
+BR_DEF_COL = "is_receiver_defendent"
+
+NORMALIZE_TYPES = {
+	"playType": "playtypes",
+	"passResult": "results",
+	"penaltyOwner": "teamtypes",
+	"typeDropback": "dropbacktypes",
+	"offenseFormation": "formations"
+}
+
+def load_script(filename):
+	path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+	name = os.path.splitext(filename)[0].replace("-", "_")
+	spec = importlib.util.spec_from_file_location(name, path)
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module
+
+gd = load_script(DATAFRAMES_SCRIPT)
+
+def read_csv_files(data_folder):
+	files = sorted(fnmatch.filter(os.listdir(data_folder), "{}*.csv".format(
+		STATS_PREFIX)))
+	if len(files) == 0:
+		raise ValueError("No {}*.csv files in {}".format(STATS_PREFIX,
+			data_folder))
+	data = pd.concat([pd.read_csv(os.path.join(data_folder, f))
+		for f in files], ignore_index=True)
+	# the stats files save the play keys as floats
+	data[PLAY_KEYS] = data[PLAY_KEYS].astype(np.int64)
+	return data.drop(columns=[INDEX_COL], errors="ignore")
+
+def read_play_data(data_folder, play_folder):
+	# the get-play-dataset.py files have no keys, their rows are in the
+	# plays.csv order
+	play_keys = pd.read_csv(os.path.join(data_folder, PLAY_FILE),
+		usecols=PLAY_KEYS)
+	y_files = sorted(fnmatch.filter(os.listdir(play_folder), "{}*.csv".format(
+		Y_PREFIX)))
+	tables = [play_keys]
+	for f in [X_FILE] + y_files:
+		table = pd.read_csv(os.path.join(play_folder, f))
+		if len(table) != len(play_keys):
+			raise ValueError("{} has {} rows, {} has {}".format(f, len(table),
+				PLAY_FILE, len(play_keys)))
+		tables.append(table)
+	data = pd.concat(tables, axis=1)
+	with open(os.path.join(play_folder, NORMALIZE_FILE)) as f:
+		normalizer = json.load(f)
+	labels = {col: normalizer[NORMALIZE_TYPES[col]] for col in data.columns
+		if col in NORMALIZE_TYPES}
+	return data, labels
+
+def read_receivers(br_folder):
+	data = read_csv_files(br_folder)
+	data = data.loc[data.groupby(PLAY_KEYS)[BR_RANK_COL].idxmin()]
+	return data[PLAY_KEYS + list(BR_COLS.keys())].rename(columns=BR_COLS)
+
+def get_cluster_folders(cluster_paths):
+	# a get-cluster.py output folder, or a folder of them as written
+	# with --model_path
+	folders = {}
+	for path in cluster_paths:
+		path = os.path.abspath(path)
+		if len(fnmatch.filter(os.listdir(path), "{}*.csv".format(
+			STATS_PREFIX))) != 0:
+			folders[os.path.basename(path)] = path
+			continue
+		for name in sorted(os.listdir(path)):
+			if os.path.isdir(os.path.join(path, name)):
+				folders[name] = os.path.join(path, name)
+	return folders
+
+def read_clusters(name, cluster_folder):
+	data = read_csv_files(cluster_folder)
+	return data.rename(columns={col: "{}_{}".format(name, col)
+		for col in data.columns if col not in KEYS})
+
+def merge_table(data, table, keys):
+	common = [col for col in table.columns
+		if col in data.columns and col not in keys]
+	if len(common) != 0:
+		raise ValueError("Columns {} are in more than one input".format(common))
+	return pd.merge(data, table, on=keys, how="left")
+
+def get_play_index(data):
+	# rows are sorted on the keys, so the rows of a play are contiguous
+	play_keys = data[PLAY_KEYS]
+	starts = np.flatnonzero(play_keys.ne(play_keys.shift()).any(axis=1).values)
+	index = play_keys.iloc[starts].reset_index(drop=True)
+	index[START_COL] = starts
+	index[END_COL] = np.append(starts[1:], len(data))
+	return index
+
+def build_store(stats_folder, output_folder, args):
+	data = read_csv_files(stats_folder)
+	print("Stats loaded, length: {}".format(len(data)))
+	labels = {}
+	if args["play_path"] is not None:
+		play_data, labels = read_play_data(os.path.abspath(args["data_path"]),
+			os.path.abspath(args["play_path"]))
+		data = merge_table(data, play_data, PLAY_KEYS)
+	if args["br_path"] is not None:
+		data = merge_table(data, read_receivers(os.path.abspath(
+			args["br_path"])), PLAY_KEYS)
+		data[BR_DEF_COL] = (data[PLAYER_COL] ==
+			data[BR_COLS["def_0"]]).astype(np.int8)
+	cluster_folders = get_cluster_folders(args["cluster_path"] or [])
+	for name in cluster_folders:
+		data = merge_table(data, read_clusters(name, cluster_folders[name]), KEYS)
+		print("Clusters of {} joined".format(name))
+
+	data = data.sort_values(KEYS, kind="mergesort").reset_index(drop=True)
+	index = get_play_index(data)
+	store = {
+		"columns": list(data.columns),
+		"clusters": list(cluster_folders.keys()),
+		"labels": labels,
+		"dtypes": {
+			TABLE_NAME: gd.save_table(data, output_folder, TABLE_NAME),
+			INDEX_NAME: gd.save_table(index, output_folder, INDEX_NAME)
+		}
+	}
+	store_path = os.path.join(output_folder, "{}.json".format(STORE_PREFIX))
+	with open(store_path, "w") as output:
+		output.write(json.dumps(store, indent=2))
+	print("Feature store with {} rows, {} plays saved to {}".format(len(data),
+		len(index), output_folder))
+
+def load_store(store_folder):
+	store_path = os.path.join(store_folder, "{}.json".format(STORE_PREFIX))
+	with open(store_path) as f:
+		store = json.load(f)
+	store["path"] = store_folder
+	return store
+
+def decode_labels(store, data):
+	for col in data.columns:
+		if col not in store["labels"]:
+			continue
+		codes = store["labels"][col]
+		data[col] = data[col].map(dict(zip(codes.values(), codes.keys())))
+	return data
+
+def encode_filter(store, col, value):
+	# label values of the normalized play columns are matched on their codes
+	if col not in store["labels"]:
+		return value
+	codes = store["labels"][col]
+	if isinstance(value, list):
+		return [codes.get(v, v) for v in value]
+	return codes.get(value, value)
+
+## filters map a column to a value, a list of values or a
+## {"min": ..., "max": ...} range
+def get_filter_mask(store, data, filters):
+	mask = np.ones(len(data), dtype=bool)
+	for col in filters:
+		value = encode_filter(store, col, filters[col])
+		if isinstance(value, dict):
+			if "min" in value:
+				mask &= (data[col] >= value["min"]).values
+			if "max" in value:
+				mask &= (data[col] <= value["max"]).values
+		elif isinstance(value, list):
+			mask &= data[col].isin(value).values
+		else:
+			mask &= (data[col] == value).values
+	return mask
+
+def check_columns(store, columns):
+	unknown = [col for col in columns if col not in store["columns"]]
+	if len(unknown) != 0:
+		raise ValueError("Unknown columns: {}".format(unknown))
+
+## only the filter, group and aggregated columns are read, the
+## groups are counted when no aggregation is given
+def query(store, filters={}, group_by=[], agg=None, columns=None,
+	decode=True):
+	if columns is None:
+		columns = store["columns"] if len(group_by) == 0 and agg is None else []
+	needed = list(dict.fromkeys(list(filters) + list(group_by) +
+		list(agg or []) + list(columns)))
+	check_columns(store, needed)
+	data = gd.load_table(store, TABLE_NAME, needed)
+	data = data[get_filter_mask(store, data, filters)]
+	if len(group_by) != 0:
+		groups = data.groupby(group_by)
+		data = groups.size().to_frame("count") if agg is None else \
+			groups.agg(agg)
+		if isinstance(data.columns, pd.MultiIndex):
+			data.columns = ["_".join(col) for col in data.columns]
+		data = data.reset_index()
+	elif agg is not None:
+		return data.agg(agg)
+	else:
+		data = data[columns].reset_index(drop=True)
+	return decode_labels(store, data) if decode else data
+
+def get_play(store, game, play, columns=None, decode=True):
+	columns = store["columns"] if columns is None else columns
+	check_columns(store, columns)
+	index = gd.load_table(store, INDEX_NAME, PLAY_KEYS + [START_COL, END_COL])
+	row = index[(index[GAME_COL] == game) & (index[PLAY_COL] == play)]
+	if len(row) == 0:
+		return pd.DataFrame(columns=columns)
+	rows = slice(row[START_COL].values[0], row[END_COL].values[0])
+	data = gd.load_table(store, TABLE_NAME, columns, rows=rows)
+	return decode_labels(store, data) if decode else data
+
+def parse_args():
+	parser = argparse.ArgumentParser()
+	parser.add_argument(
+		"--stats_path", type=str,
+		help="specifies the folder containing the compute-tracking-stats.py output",
+		required=True)
+	parser.add_argument(
+		"--output_path", type=str, help="specifies the output folder path",
+		required=True)
+	parser.add_argument(
+		"--play_path", type=str,
+		help="specifies the folder containing the get-play-dataset.py output",
+		required=False)
+	parser.add_argument(
+		"--data_path", type=str,
+		help="specifies the folder containing data files, needed with --play_path",
+		required=False)
+	parser.add_argument(
+		"--br_path", type=str, help="specifies the folder containing ball receiver data",
+		required=False)
+	parser.add_argument(
+		"--cluster_path", type=str, nargs="+",
+		help="specifies the folders containing the get-cluster.py output",
+		required=False)
+	args = vars(parser.parse_args())
+	if args["play_path"] is not None and args["data_path"] is None:
+		parser.error("--play_path needs --data_path for the play keys")
+	return args
+
+def main():
+	args = parse_args()
+	print("Args: {}".format(args))
+	stats_path = os.path.abspath(args["stats_path"])
+	output_path = os.path.abspath(args["output_path"])
+
+	build_store(stats_path, output_path, args)
+
+if __name__ == "__main__":
+	main()
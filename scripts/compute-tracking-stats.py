@@ -1,7 +1,7 @@
 # Metrics defined in paper - https://arxiv.org/abs/1906.11373
 # "Unsupervised Methods for Identifying Pass Coverage Among Defensive Backs with NFL Player Tracking Data"
 
-import argparse, os, fnmatch, math
+import argparse, os, fnmatch, math, json, time, importlib.util
 import pandas as pd
 
 TRACK_PREFIX = "week"
@@ -80,6 +80,46 @@ A_M_PREFIX = "at_mid_"
 
 NO_VALUE = -1000
 
+MEMORY_SCRIPT = "memory-tracker.py"
+SHARD_SCRIPT = "merge-shards.py"
+PROGRESS_SCRIPT = "progress-reporter.py"
+SAMPLE_ROWS = 10000
+MIN_CHUNK_ROWS = 1000
+# a chunk, the game carried over to the next chunk and the game / play
+# copies are in memory at the same time
+CHUNK_FACTOR = 4
+STRIDE_ERROR_FILE = "frame-stride-error.json"
+FIELDS_KEY = "fields"
+SKIP_COLS_KEY = "global_skip_cols"
+
+WINDOWS = [A_BS_PREFIX, A_AS_PREFIX, A_BSP_PREFIX, A_BP_PREFIX, A_AP_PREFIX,
+	A_FULL_PREFIX]
+# the frame stats each feature is computed from
+FEATURE_STATS = {
+	A_X: [S_X],
+	A_Y: [S_Y],
+	A_S: [S_SPEED],
+	A_DO: [S_DIST_OFF],
+	A_DD: [S_DIST_DEF],
+	A_DIRO: [S_DIR_OFF],
+	A_R: [S_DIST_OFF, S_DIST_OFF_DEF]
+}
+RATIO_COLUMNS = [A_FULL_PREFIX + A_MEAN_PREFIX + A_R,
+	A_FULL_PREFIX + A_VAR_PREFIX + A_R, A_S_PREFIX + A_R, A_P_PREFIX + A_R,
+	A_M_PREFIX + A_R]
+
+def load_script(filename):
+	path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+	name = os.path.splitext(filename)[0].replace("-", "_")
+	spec = importlib.util.spec_from_file_location(name, path)
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module
+
+mt = load_script(MEMORY_SCRIPT)
+pr = load_script(PROGRESS_SCRIPT)
+ms = load_script(SHARD_SCRIPT)
+
 def compute_common_stats(data, game, play):
 	stats = {}
 	data = data[(data[GAME_ID] == game) & (data[PLAY_ID] == play)]
@@ -155,7 +195,56 @@ def update_stats(stats, player, oPlayer, dPlayer, closest_to_football,
 	}
 	append_stats(stats, new_stats)
 
-def get_stats_for_frame(data, common_stats, stats, frame, br_info):
+def get_column_features():
+	# every feature column and the feature it is computed for
+	columns = {w + prefix + name: name for name in FEATURE_STATS if name != A_R
+		for w in WINDOWS for prefix in [A_MEAN_PREFIX, A_VAR_PREFIX]}
+	columns.update({c: A_R for c in RATIO_COLUMNS})
+	return columns
+
+def get_feature_columns():
+	return list(get_column_features().keys())
+
+## a feature config is either a feature list with a "fields" key or a
+## run-gmm.py config, whose features are the ones not skipped
+def load_features(config_paths):
+	all_columns = get_feature_columns()
+	features = set()
+	for config_path in config_paths:
+		with open(config_path) as f:
+			config = json.load(f)
+		if FIELDS_KEY in config:
+			features.update(c for c in config[FIELDS_KEY] if c in all_columns)
+		elif SKIP_COLS_KEY in config:
+			features.update(c for c in all_columns
+				if c not in config[SKIP_COLS_KEY])
+		else:
+			raise ValueError("{} has neither {} nor {}".format(config_path,
+				FIELDS_KEY, SKIP_COLS_KEY))
+	if len(features) == 0:
+		raise ValueError("The feature configs select no features")
+	return features
+
+def get_selection(features):
+	# the columns to compute and the frame stats they need, None computes all
+	if features is None:
+		return None
+	column_features = get_column_features()
+	selection = {
+		"columns": set(features),
+		"stats": set(s for c in features
+			for s in FEATURE_STATS[column_features[c]])
+	}
+	return selection
+
+def is_needed(selection, *stats):
+	return selection is None or any(s in selection["stats"] for s in stats)
+
+def is_selected(selection, *columns):
+	return selection is None or any(c in selection["columns"] for c in columns)
+
+def get_stats_for_frame(data, common_stats, stats, frame, br_info,
+	selection=None):
 	(receiver, closest_defendent) = br_info
 	offense = data[data[TEAM_FLD] == common_stats[S_OFFENSE]]
 	defense = data[data[TEAM_FLD] == common_stats[S_DEFENSE]]
@@ -172,9 +261,11 @@ def get_stats_for_frame(data, common_stats, stats, frame, br_info):
 	nearest_cb_to_br = get_nearest(ball_receiver, cornerback) \
 		if len(ball_receiver) == 1 else None
 	for _,cb in defendents.iterrows():
-		defense_without_cb = defense[defense[NFL_ID] != cb[NFL_ID]]
-		nearest_off = get_nearest(cb, offense)
-		nearest_def = get_nearest(cb, defense_without_cb)
+		# the nearest players are only searched for the selected features
+		nearest_off = get_nearest(cb, offense) if is_needed(selection,
+			S_DIST_OFF, S_DIR_OFF, S_DIST_OFF_DEF) else None
+		nearest_def = get_nearest(cb, defense[defense[NFL_ID] != cb[NFL_ID]]) \
+			if is_needed(selection, S_DIST_DEF, S_DIST_OFF_DEF) else None
 		closest_to_football = 1 if nearest_ball is not None and \
 			(cb[NFL_ID] == nearest_ball[NFL_ID]) else 0
 		close_to_br = 1 if (nearest_cb_to_br is not None and \
@@ -205,7 +296,7 @@ def split_by_events(data, events):
 	new_data = [data[before_snap], data[between_snap_pass], data[after_pass]]
 	return new_data
 
-def set_mean_variance(stats, data, events, dataname):
+def set_mean_variance(stats, data, events, dataname, selection=None):
 	split_data = split_by_events(data, events)
 	# before snap, after snap, between snap and pass,
 	# before pass, after pass, full
@@ -219,11 +310,15 @@ def set_mean_variance(stats, data, events, dataname):
 	}
 
 	for item in data_map:
-		mean,variance = get_mean_variance(data_map[item])
 		item_mean_key = item + A_MEAN_PREFIX + dataname
 		item_var_key = item + A_VAR_PREFIX + dataname
-		stats[item_mean_key] = mean
-		stats[item_var_key] = variance
+		if not is_selected(selection, item_mean_key, item_var_key):
+			continue
+		mean,variance = get_mean_variance(data_map[item])
+		if is_selected(selection, item_mean_key):
+			stats[item_mean_key] = mean
+		if is_selected(selection, item_var_key):
+			stats[item_var_key] = variance
 
 def get_mean_variance(data):
 	data = [x for x in data if is_valid(x)]
@@ -233,7 +328,8 @@ def get_mean_variance(data):
 	variance = sum((i - mean) ** 2 for i in data) / len(data)
 	return mean, variance
 
-def set_ratio_mean_variance(stats, num, den, events, dataname):
+def set_ratio_mean_variance(stats, num, den, events, dataname,
+	selection=None):
 	full_ratio = get_ratio(num, den)
 	mean, variance = get_mean_variance(full_ratio)
 	num_split = split_by_events(num, events)
@@ -242,11 +338,16 @@ def set_ratio_mean_variance(stats, num, den, events, dataname):
 	pass_value = get_ratio_value(num_split[1][-1], den_split[1][-1])
 	mid_index = math.ceil(len(num_split[1]) / 2) - 1
 	mid_value = get_ratio_value(num_split[1][mid_index], den_split[1][mid_index])
-	stats[A_FULL_PREFIX + A_MEAN_PREFIX + dataname] = mean
-	stats[A_FULL_PREFIX + A_VAR_PREFIX + dataname] = variance
-	stats[A_S_PREFIX + dataname] = snap_value
-	stats[A_P_PREFIX + dataname] = pass_value
-	stats[A_M_PREFIX + dataname] = mid_value
+	values = {
+		A_FULL_PREFIX + A_MEAN_PREFIX + dataname: mean,
+		A_FULL_PREFIX + A_VAR_PREFIX + dataname: variance,
+		A_S_PREFIX + dataname: snap_value,
+		A_P_PREFIX + dataname: pass_value,
+		A_M_PREFIX + dataname: mid_value
+	}
+	for key in values:
+		if is_selected(selection, key):
+			stats[key] = values[key]
 
 def get_ratio_value(n, d):
 	return n/d if (is_valid(n) and is_valid(d) and d != 0) else 0
@@ -256,7 +357,7 @@ def get_ratio(num, den):
 		is_valid(d) and d != 0 ) ]
 	return [n/d for (n,d) in zipped]
 
-def gather_frame_stats(frame_stats, game, play):
+def gather_frame_stats(frame_stats, game, play, selection=None):
 	data = pd.DataFrame()
 	not_cb_player = None
 	cb_closest_to_br = None
@@ -273,14 +374,15 @@ def gather_frame_stats(frame_stats, game, play):
 			PLAY_ID: play,
 			A_CLOSEST: 	sum(stats[S_FB_CLOSEST])
 		}
-		set_mean_variance(new_stats, stats[S_X], events, A_X)
-		set_mean_variance(new_stats, stats[S_Y], events, A_Y)
-		set_mean_variance(new_stats, stats[S_SPEED], events, A_S)
-		set_mean_variance(new_stats, stats[S_DIST_OFF], events, A_DO)
-		set_mean_variance(new_stats, stats[S_DIST_DEF], events, A_DD)
-		set_mean_variance(new_stats, stats[S_DIR_OFF], events, A_DIRO)
-		set_ratio_mean_variance(new_stats, stats[S_DIST_OFF],
-			stats[S_DIST_OFF_DEF], events, A_R)
+		set_mean_variance(new_stats, stats[S_X], events, A_X, selection)
+		set_mean_variance(new_stats, stats[S_Y], events, A_Y, selection)
+		set_mean_variance(new_stats, stats[S_SPEED], events, A_S, selection)
+		set_mean_variance(new_stats, stats[S_DIST_OFF], events, A_DO, selection)
+		set_mean_variance(new_stats, stats[S_DIST_DEF], events, A_DD, selection)
+		set_mean_variance(new_stats, stats[S_DIR_OFF], events, A_DIRO, selection)
+		if is_selected(selection, *RATIO_COLUMNS):
+			set_ratio_mean_variance(new_stats, stats[S_DIST_OFF],
+				stats[S_DIST_OFF_DEF], events, A_R, selection)
 		player_stats[player] = new_stats
 
 		if max(stats[S_NOT_CB]) == 1:
@@ -312,8 +414,19 @@ def get_ball_receiver_info(br_data, game, play):
 		return (None, None)
 	return (br_row[BR_RECEIVER_FLD].values[0], br_row[BR_DEF_FLD].values[0])
 
-def compute_stats_for_play(data, game, play, common_data, br_data):
+def get_frames(data, frame_stride):
 	frames = sorted(data[FRAME_ID].unique())
+	if frame_stride == 1:
+		return frames
+	# the snap and pass frames bound the event windows, they are always kept
+	event_frames = set(data.loc[data[EVENT].isin([SNAP_EVENT] + PASS_EVENTS),
+		FRAME_ID].unique())
+	return [frame for (i, frame) in enumerate(frames)
+		if i % frame_stride == 0 or frame in event_frames]
+
+def compute_stats_for_play(data, game, play, common_data, br_data,
+	frame_stride=1, selection=None):
+	frames = get_frames(data, frame_stride)
 	# print("Total frames: {}".format(len(frames)))
 	br_info = get_ball_receiver_info(br_data, game, play)
 	common_stats = compute_common_stats(common_data, game, play)
@@ -321,49 +434,237 @@ def compute_stats_for_play(data, game, play, common_data, br_data):
 	for frame in frames:
 		frame_data = data[data[FRAME_ID] == frame]
 		get_stats_for_frame(frame_data, common_stats, stats, frame,
-			br_info)
-	stats_data = gather_frame_stats(stats, game, play)
+			br_info, selection)
+	stats_data = gather_frame_stats(stats, game, play, selection)
 	return stats_data
 
-def compute_stats_for_game(data, game, common_data, br_data):
+def compute_stats_for_game(data, game, common_data, br_data, frame_stride=1,
+	progress=None, selection=None):
 	plays = sorted(data[PLAY_ID].unique())
 	stats_data = pd.DataFrame()
 	for play in plays:
 		# print("Processing play {} ...".format(play))
 		play_data = data[data[PLAY_ID] == play]
 		play_stats = compute_stats_for_play(play_data, game, play,
-			common_data, br_data)
+			common_data, br_data, frame_stride, selection)
 		stats_data = stats_data.append(play_stats, ignore_index=True)
+		pr.update(progress, plays=1)
+	pr.update(progress, games=1)
 	return stats_data
 
 def compute_stats_for_file(filename, data_folder, output_folder, common_data,
-	br_data):
+	br_data, shard=None, frame_stride=1, progress=None, selection=None):
 	file_path = os.path.join(data_folder, filename)
 	output_file = os.path.join(output_folder, filename)
 	stats = pd.DataFrame()
 	data = pd.read_csv(file_path)
-	games = sorted(data[GAME_ID].unique())
+	all_games = sorted(data[GAME_ID].unique())
+	games = ms.get_shard_games(all_games, shard)
 	for game in games:
 		print("Processing game {} ...".format(game))
 		game_data = data[data[GAME_ID] == game]
 		game_stats = compute_stats_for_game(game_data, game,
-			common_data, br_data)
+			common_data, br_data, frame_stride, progress, selection)
 		stats = stats.append(game_stats, ignore_index=True)
 	stats.to_csv(output_file)
-
-def compute_stats(data_folder, output_folder, br_data):
+	return (all_games, games, len(stats))
+
+def get_chunk_rows(file_path, tracker):
+	sample = pd.read_csv(file_path, nrows=SAMPLE_ROWS)
+	row_bytes = sample.memory_usage(deep=True).sum() / max(len(sample), 1)
+	mt.check_budget(tracker, row_bytes * CHUNK_FACTOR * MIN_CHUNK_ROWS,
+		"Reading {} in chunks of {} rows".format(os.path.basename(file_path),
+		MIN_CHUNK_ROWS))
+	return int(mt.get_budget(tracker) / (row_bytes * CHUNK_FACTOR))
+
+def save_game_stats(data, game, output_file, common_data, br_data, row_count,
+	frame_stride, progress, selection):
+	game_stats = compute_stats_for_game(data[data[GAME_ID] == game], game,
+		common_data, br_data, frame_stride, progress, selection)
+	if len(game_stats) == 0:
+		return row_count
+	game_stats.index += row_count
+	game_stats.to_csv(output_file, mode="w" if row_count == 0 else "a",
+		header=row_count == 0)
+	return row_count + len(game_stats)
+
+## the file is read in chunks sized to the memory limit, a game is
+## computed once all its rows are read and its stats are appended to
+## the output file, so only a chunk and one game are kept in memory
+def compute_stats_for_file_bounded(filename, data_folder, output_folder,
+	common_data, br_data, tracker, shard=None, frame_stride=1, progress=None,
+	selection=None):
+	file_path = os.path.join(data_folder, filename)
+	output_file = os.path.join(output_folder, filename)
+	chunk_rows = get_chunk_rows(file_path, tracker)
+	print("Reading {} rows per chunk".format(chunk_rows))
+	done = set()
+	row_count = 0
+	carry = None
+	for chunk in pd.read_csv(file_path, chunksize=chunk_rows):
+		data = chunk if carry is None else pd.concat([carry, chunk],
+			ignore_index=True)
+		del chunk, carry
+		games = data[GAME_ID].unique()
+		if any(game in done for game in games):
+			raise ValueError("The rows of a game are not contiguous in {}, run "
+				"without --memory_limit".format(filename))
+		# the last game may go on in the next chunk
+		for game in games[:-1]:
+			done.add(game)
+			if not ms.in_shard(game, shard):
+				continue
+			print("Processing game {} ...".format(game))
+			row_count = save_game_stats(data, game, output_file, common_data,
+				br_data, row_count, frame_stride, progress, selection)
+		carry = data[data[GAME_ID] == games[-1]]
+		del data
+		if len(carry) > chunk_rows:
+			raise MemoryError("Game {} has more than the {} rows per chunk that "
+				"fit under the memory limit".format(games[-1], chunk_rows))
+	if carry is not None:
+		game = carry[GAME_ID].values[0]
+		done.add(game)
+		if ms.in_shard(game, shard):
+			print("Processing game {} ...".format(game))
+			row_count = save_game_stats(carry, game, output_file, common_data,
+				br_data, row_count, frame_stride, progress, selection)
+	if row_count == 0:
+		pd.DataFrame().to_csv(output_file)
+	all_games = sorted(done)
+	return (all_games, ms.get_shard_games(all_games, shard), row_count)
+
+def load_common_data(data_folder):
 	game_file = os.path.join(data_folder, "{}.csv".format(GAME_FILE))
 	play_file = os.path.join(data_folder, "{}.csv".format(PLAY_FILE))
 	game_data = pd.read_csv(game_file)
 	play_data = pd.read_csv(play_file)
-	common_data = pd.merge(play_data, game_data, on=[GAME_ID], how="left")
+	return pd.merge(play_data, game_data, on=[GAME_ID], how="left")
+
+def new_progress(progress_path=None, metrics_path=None):
+	return pr.new_progress(os.path.basename(__file__), {"plays": 0, "games": 0},
+		progress_path, metrics_path)
+
+def add_progress_totals(progress, common_data, shard):
+	# the totals are taken from the plays file, the tracking files are only
+	# read one at a time
+	games = ms.get_shard_games(common_data[GAME_ID].unique(), shard)
+	pr.add_totals(progress, plays=int(common_data[GAME_ID].isin(games).sum()),
+		games=len(games))
+
+def compute_stats(data_folder, output_folder, br_data, tracker=None,
+	shard=None, frame_stride=1, progress=None, features=None):
+	if tracker is None:
+		tracker = mt.new_tracker()
+	selection = get_selection(features)
+	if features is not None:
+		print("Computing {} of {} features".format(len(features),
+			len(get_feature_columns())))
+	if progress is None:
+		progress = new_progress()
+	if shard is not None:
+		output_folder = ms.get_shard_folder(output_folder, shard)
+		manifest = ms.new_manifest(shard, os.path.basename(__file__))
+	with mt.stage(tracker, "load_plays"):
+		common_data = load_common_data(data_folder)
+	add_progress_totals(progress, common_data, shard)
 
 	track_files = fnmatch.filter(os.listdir(data_folder), "{}*.csv".format(
 		TRACK_PREFIX))
 	for tf in track_files:
 		print("Working on file {} ...".format(tf))
-		compute_stats_for_file(tf, data_folder, output_folder, common_data,
-			br_data)
+		pr.set_stage(progress, tf)
+		with mt.stage(tracker, tf):
+			if tracker["limit"] is None:
+				file_games = compute_stats_for_file(tf, data_folder, output_folder,
+					common_data, br_data, shard, frame_stride, progress,
+					selection)
+			else:
+				file_games = compute_stats_for_file_bounded(tf, data_folder,
+					output_folder, common_data, br_data, tracker, shard,
+					frame_stride, progress, selection)
+		if shard is not None:
+			ms.add_file(manifest, tf, *file_games)
+	if shard is not None:
+		ms.save_manifest(output_folder, manifest)
+	pr.finish(progress)
+
+def sample_plays(data_folder, track_files, play_count):
+	plays = []
+	for tf in track_files:
+		file_plays = pd.read_csv(os.path.join(data_folder, tf),
+			usecols=[GAME_ID, PLAY_ID]).drop_duplicates()
+		file_plays["file"] = tf
+		plays.append(file_plays)
+	plays = pd.concat(plays, ignore_index=True)
+	return plays.sample(n=min(play_count, len(plays)), random_state=0)
+
+## the sampled plays are computed at the full frame rate and with the
+## stride, the error of every stats column is measured on the defenders
+## found by both
+def report_stride_error(data_folder, output_folder, br_data, frame_stride,
+	play_count, features=None):
+	selection = get_selection(features)
+	common_data = load_common_data(data_folder)
+	track_files = sorted(fnmatch.filter(os.listdir(data_folder), "{}*.csv".format(
+		TRACK_PREFIX)))
+	plays = sample_plays(data_folder, track_files, play_count)
+	print("Measuring the frame stride error on {} plays ...".format(len(plays)))
+	full = []
+	strided = []
+	full_seconds = 0
+	stride_seconds = 0
+	for tf in track_files:
+		file_plays = plays[plays["file"] == tf]
+		if len(file_plays) == 0:
+			continue
+		data = pd.read_csv(os.path.join(data_folder, tf))
+		for (game, play) in zip(file_plays[GAME_ID], file_plays[PLAY_ID]):
+			play_data = data[(data[GAME_ID] == game) & (data[PLAY_ID] == play)]
+			start = time.time()
+			full.append(compute_stats_for_play(play_data, game, play, common_data,
+				br_data, 1, selection))
+			full_seconds += time.time() - start
+			start = time.time()
+			strided.append(compute_stats_for_play(play_data, game, play,
+				common_data, br_data, frame_stride, selection))
+			stride_seconds += time.time() - start
+	full = pd.concat(full, ignore_index=True)
+	if len(full) == 0:
+		raise ValueError("The sampled plays have no stats")
+	keys = [GAME_ID, PLAY_ID, NFL_ID]
+	data = pd.merge(full, pd.concat(strided, ignore_index=True), on=keys,
+		suffixes=("_full", "_stride"))
+	errors = {}
+	for col in full.columns:
+		if col in keys:
+			continue
+		diff = (data[col + "_full"] - data[col + "_stride"]).abs()
+		scale = data[col + "_full"].abs().mean()
+		errors[col] = {
+			"mean_abs_error": diff.mean(),
+			"max_abs_error": diff.max(),
+			"relative_error": diff.mean() / scale if scale != 0 else 0
+		}
+	report = {
+		"frame_stride": frame_stride,
+		"plays": len(plays),
+		"full_rows": len(full),
+		"matched_rows": len(data),
+		"full_seconds": full_seconds,
+		"stride_seconds": stride_seconds,
+		"speedup": full_seconds / stride_seconds if stride_seconds != 0 else 0,
+		"features": errors
+	}
+	output_path = os.path.join(output_folder, STRIDE_ERROR_FILE)
+	with open(output_path, "w") as output:
+		output.write(json.dumps(report, indent=2))
+	worst = sorted(errors, key=lambda col: errors[col]["relative_error"],
+		reverse=True)[:5]
+	print("Frame stride {} speedup: {:.1f}x, largest relative errors: {}".format(
+		frame_stride, report["speedup"], ", ".join("{} {:.3f}".format(col,
+		errors[col]["relative_error"]) for col in worst)))
+	print("Frame stride error saved to {}".format(output_path))
 
 def ball_receiver_data(config):
 	if config["br_path"] is None:
@@ -392,15 +693,65 @@ def parse_args():
 	parser.add_argument(
 		"--br_path", type=str, help="specifies the folder containing ball receiver data",
 		required=False)
-	return vars(parser.parse_args())
+	parser.add_argument(
+		"--memory_limit", type=float,
+		help="specifies the memory limit in MB, the tracking files are then "
+		"read in chunks sized to stay under it", required=False)
+	parser.add_argument(
+		"--memory_profile", action="store_true",
+		help="traces the allocations of every stage and saves memory.json",
+		required=False)
+	parser.add_argument(
+		"--shard", type=ms.parse_shard,
+		help="specifies the shard i/n of the games to process (i from 0), the "
+		"files are written in a shard-<i>-of-<n> folder", required=False)
+	parser.add_argument(
+		"--frame_stride", type=int, default=1,
+		help="specifies that only every n-th frame is used, the snap and pass "
+		"frames are always used", required=False)
+	parser.add_argument(
+		"--stride_error_plays", type=int, default=0,
+		help="specifies the number of sampled plays the frame stride stats are "
+		"compared on against the full frame rate stats", required=False)
+	parser.add_argument(
+		"--feature_config", type=str, nargs="+",
+		help="specifies run-gmm.py configs or feature lists (with a \"fields\" "
+		"key), only the features they keep are computed", required=False)
+	parser.add_argument(
+		"--progress_path", type=str,
+		help="specifies the file the progress json lines are appended to, "
+		"they are printed when not given", required=False)
+	parser.add_argument(
+		"--metrics_path", type=str,
+		help="specifies the metrics text file the progress is also written to, "
+		"for the node exporter textfile collector", required=False)
+	args = vars(parser.parse_args())
+	if args["frame_stride"] < 1:
+		parser.error("--frame_stride should be at least 1")
+	if args["stride_error_plays"] > 0 and args["frame_stride"] == 1:
+		parser.error("--stride_error_plays needs a --frame_stride above 1")
+	return args
 
 def main():
 	args = parse_args()
 	print("Args: {}".format(args))
 	data_path = os.path.abspath(args["data_path"])
 	output_path = os.path.abspath(args["output_path"])
-	br_data = ball_receiver_data(args)
-
-	compute_stats(data_path, output_path, br_data)
-
-main()
\ No newline at end of file
+	tracker = mt.new_tracker(args["memory_profile"], args["memory_limit"])
+	features = None if args["feature_config"] is None else \
+		load_features([os.path.abspath(p) for p in args["feature_config"]])
+
+	progress = new_progress(args["progress_path"], args["metrics_path"])
+	with mt.report_on_error(tracker, output_path):
+		with mt.stage(tracker, "load_receivers"):
+			br_data = ball_receiver_data(args)
+		compute_stats(data_path, output_path, br_data, tracker, args["shard"],
+			args["frame_stride"], progress, features)
+	if args["stride_error_plays"] > 0:
+		report_stride_error(data_path, output_path, br_data,
+			args["frame_stride"], args["stride_error_plays"], features)
+	if args["memory_profile"]:
+		mt.save_report(tracker, output_path)
+
+if __name__ == "__main__":
+	main()
@@ -1,4 +1,4 @@
-import argparse, os, fnmatch, math
+import argparse, os, fnmatch, math, importlib.util
 import pandas as pd
 from scipy import stats as scipystats
 
@@ -38,6 +38,20 @@ MAX_RECEIVERS = 3
 YARDS_AROUND = 10
 MAX_DEFENDENTS = 2
 
+SHARD_SCRIPT = "merge-shards.py"
+PROGRESS_SCRIPT = "progress-reporter.py"
+
+def load_script(filename):
+	path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+	name = os.path.splitext(filename)[0].replace("-", "_")
+	spec = importlib.util.spec_from_file_location(name, path)
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module
+
+ms = load_script(SHARD_SCRIPT)
+pr = load_script(PROGRESS_SCRIPT)
+
 def get_basename(filename):
 	return os.path.splitext(os.path.basename(filename))[0]
 
@@ -232,7 +246,7 @@ def compute_for_play(data, game, play, common_data):
 		return None
 	return pd.DataFrame(row_list)
 
-def compute_for_game(data, game, common_data):
+def compute_for_game(data, game, common_data, progress=None):
 	plays = sorted(data[PLAY_ID].unique())
 	receiver_data = pd.DataFrame()
 	for play in plays:
@@ -241,36 +255,62 @@ def compute_for_game(data, game, common_data):
 		pr_data = compute_for_play(play_data, game, play, common_data)
 		if pr_data is not None:
 			receiver_data = receiver_data.append(pr_data, ignore_index=True)
+		pr.update(progress, plays=1)
+	pr.update(progress, games=1)
 	return receiver_data
 
-def compute_for_file(filename, data_folder, output_folder, common_data):
+def compute_for_file(filename, data_folder, output_folder, common_data,
+	shard=None, progress=None):
 	file_path = os.path.join(data_folder, filename)
 	receiver_data = pd.DataFrame()
 	data = pd.read_csv(file_path)
-	games = sorted(data[GAME_ID].unique())
+	all_games = sorted(data[GAME_ID].unique())
+	games = ms.get_shard_games(all_games, shard)
 	for game in games:
 		print("Processing game {} ...".format(game))
 		game_data = data[data[GAME_ID] == game]
-		gr_data = compute_for_game(game_data, game, common_data)
+		gr_data = compute_for_game(game_data, game, common_data, progress)
 		receiver_data = receiver_data.append(gr_data, ignore_index=True)
 	output_file = os.path.join(output_folder, "{}.json".format(
 		get_basename(filename)))
 	receiver_data.to_json(output_file, orient="records", indent=4)
 	output_file = os.path.join(output_folder, filename)
 	receiver_data.to_csv(output_file)
+	return (all_games, games, len(receiver_data))
+
+def new_progress(progress_path=None, metrics_path=None):
+	return pr.new_progress(os.path.basename(__file__), {"plays": 0, "games": 0},
+		progress_path, metrics_path)
 
-def compute_ball_receiver(data_folder, output_folder):
+def compute_ball_receiver(data_folder, output_folder, shard=None,
+	progress=None):
+	if progress is None:
+		progress = new_progress()
 	game_file = os.path.join(data_folder, "{}.csv".format(GAME_FILE))
 	play_file = os.path.join(data_folder, "{}.csv".format(PLAY_FILE))
 	game_data = pd.read_csv(game_file)
 	play_data = pd.read_csv(play_file)
 	common_data = pd.merge(play_data, game_data, on=[GAME_ID], how="left")
+	# the totals are taken from the plays file
+	games = ms.get_shard_games(game_data[GAME_ID].unique(), shard)
+	pr.add_totals(progress, plays=int(play_data[GAME_ID].isin(games).sum()),
+		games=len(games))
 
 	track_files = fnmatch.filter(os.listdir(data_folder), "{}*.csv".format(
 		TRACK_PREFIX))
+	if shard is not None:
+		output_folder = ms.get_shard_folder(output_folder, shard)
+		manifest = ms.new_manifest(shard, os.path.basename(__file__))
 	for tf in track_files:
 		print("Working on file {} ...".format(tf))
-		compute_for_file(tf, data_folder, output_folder, common_data)
+		pr.set_stage(progress, tf)
+		file_games = compute_for_file(tf, data_folder, output_folder, common_data,
+			shard, progress)
+		if shard is not None:
+			ms.add_file(manifest, tf, *file_games)
+	if shard is not None:
+		ms.save_manifest(output_folder, manifest)
+	pr.finish(progress)
 
 def parse_args():
 	parser = argparse.ArgumentParser()
@@ -280,6 +320,18 @@ def parse_args():
 	parser.add_argument(
 		"--output_path", type=str, help="specifies the output folder path",
 		required=True)
+	parser.add_argument(
+		"--shard", type=ms.parse_shard,
+		help="specifies the shard i/n of the games to process (i from 0), the "
+		"files are written in a shard-<i>-of-<n> folder", required=False)
+	parser.add_argument(
+		"--progress_path", type=str,
+		help="specifies the file the progress json lines are appended to, "
+		"they are printed when not given", required=False)
+	parser.add_argument(
+		"--metrics_path", type=str,
+		help="specifies the metrics text file the progress is also written to, "
+		"for the node exporter textfile collector", required=False)
 	return vars(parser.parse_args())
 
 def main():
@@ -288,6 +340,8 @@ def main():
 	data_path = os.path.abspath(args["data_path"])
 	output_path = os.path.abspath(args["output_path"])
 
-	compute_ball_receiver(data_path, output_path)
+	progress = new_progress(args["progress_path"], args["metrics_path"])
+	compute_ball_receiver(data_path, output_path, args["shard"], progress)
 
-main()
+if __name__ == "__main__":
+	main()
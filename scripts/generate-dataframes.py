@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
 import os, argparse, fnmatch, re, json
+from joblib import Parallel, delayed
 
 TRACK_PREFIX = "week"
 GAME_PREFIX = "games"
@@ -18,6 +19,15 @@ NAN_VALUE = "NAN"
 NUMERIC_COL = "number"
 
 NORMALIZE_PREFIX = "normalizer"
+DATASET_PREFIX = "dataset"
+
+TRACK_NORMALIZE_META = {
+	"event": "events",
+	"position": "positions",
+	"team": "teamtypes",
+	"playDirection": "directions",
+	"route": "routes"
+}
 
 ## appends new_list to old_list without 
 ## creating duplicates while maintaining existing
@@ -26,14 +36,18 @@ def appendTo(norm_map, value, new_list):
 	new_list = sorted(new_list)
 	if value not in norm_map:
 		norm_map[value] = { NAN_VALUE: 0 }
-	old_list = list(norm_map[value].keys())
-	only_new_items = [item for item in new_list if item not in old_list]
-	index = len(old_list) 
+	vocabulary = norm_map[value]
 	for item in new_list:
-		if item in old_list:
+		if item in vocabulary:
 			continue
-		norm_map[value][item] = index
-		index = index + 1
+		vocabulary[item] = len(vocabulary)
+
+## codes are given in insertion order, so the code of
+## a value is its position in the vocabulary
+def encode(data, norm_map, value):
+	appendTo(norm_map, value, list(data.unique()))
+	vocabulary = pd.Index(list(norm_map[value].keys()))
+	return vocabulary.get_indexer(data)
 
 def normalize_same_type(data, data_format, norm_map):
 	if data_format == NUMERIC_COL:
@@ -44,9 +58,7 @@ def normalize_same_type(data, data_format, norm_map):
 	data = data.fillna(NAN_VALUE)
 	columns = list(data.columns)
 	for col in columns:
-		unique_values = list(data[col].unique())
-		appendTo(norm_map, data_format, unique_values)
-		data = data.replace({col: norm_map[data_format]})
+		data[col] = encode(data[col], norm_map, data_format)
 	data = data.astype(np.int8)
 	return data
 
@@ -82,10 +94,7 @@ def normalize_data(data, meta, norm_map, split={}):
 	data[boolean_cols] = data[boolean_cols].astype(np.int8)
 
 	for col in meta:
-		unique_values = list(data[col].unique())
-		value = meta[col]
-		appendTo(norm_map, value, unique_values)
-		data = data.replace({col: norm_map[value]})
+		data[col] = encode(data[col], norm_map, meta[col])
 
 	meta_cols = list(meta.keys())
 	data[meta_cols] = data[meta_cols].astype(np.int8)
@@ -146,14 +155,7 @@ def normalize_game(data, normalize_map):
 def normalize_track(data, normalize_map):
 	SKIP_COLS = ["time", "displayName"]
 	data = data.drop(columns=SKIP_COLS)
-	normalize_meta = {
-		"event": "events",
-		"position": "positions",
-		"team": "teamtypes",
-		"playDirection": "directions",
-		"route": "routes"
-	}
-	return normalize_data(data, normalize_meta, normalize_map)
+	return normalize_data(data, TRACK_NORMALIZE_META, normalize_map)
 
 def save_dataframe_as_json(dataframe, output_path, filename):
 	json_data = dataframe.to_json(orient="records", indent=2)
@@ -161,7 +163,110 @@ def save_dataframe_as_json(dataframe, output_path, filename):
 	with open(json_path, "w") as output:
 		output.write(json_data)
 
-def get_dataframes(data_path, output_path):
+## every column of a table is saved as its own npy file,
+## so readers only load (memory map) the columns they use
+def save_table(data, output_path, name):
+	table_path = os.path.join(output_path, name)
+	os.makedirs(table_path, exist_ok=True)
+	columns = {}
+	for col in data.columns:
+		values = data[col].values
+		np.save(os.path.join(table_path, "{}.npy".format(col)), values,
+			allow_pickle=values.dtype == object)
+		columns[col] = str(values.dtype)
+	return columns
+
+def load_table(dataset, name, columns, rows=slice(None)):
+	table_path = os.path.join(dataset["path"], name)
+	data = {}
+	for col in columns:
+		mmap_mode = None if dataset["dtypes"][name][col] == "object" else "r"
+		data[col] = np.load(os.path.join(table_path, "{}.npy".format(col)),
+			mmap_mode=mmap_mode, allow_pickle=mmap_mode is None)[rows]
+	return pd.DataFrame(data)
+
+def load_dataset(dataset_path):
+	dataset_file = os.path.join(dataset_path, "{}.json".format(DATASET_PREFIX))
+	with open(dataset_file) as f:
+		dataset = json.load(f)
+	dataset["path"] = dataset_path
+	return dataset
+
+## returns the week tracking data joined with its play and
+## game data, only the requested columns are read and plays
+## and games are only joined when one of their columns is used
+def read_week(dataset, week, columns=None):
+	columns = dataset["columns"] if columns is None else list(columns)
+	unknown = [c for c in columns if c not in dataset["columns"]]
+	if len(unknown) != 0:
+		raise ValueError("Unknown columns: {}".format(unknown))
+	track_cols = [c for c in dataset["dtypes"][week] if c in columns]
+	play_cols = [c for c in dataset["dtypes"][PLAY_PREFIX]
+		if c in columns and c not in track_cols]
+	game_cols = [c for c in dataset["dtypes"][GAME_PREFIX]
+		if c in columns and c not in track_cols + play_cols]
+	keys = []
+	if len(play_cols) != 0:
+		keys = [GAME_COL, PLAY_COL]
+	elif len(game_cols) != 0:
+		keys = [GAME_COL]
+	data = load_table(dataset, week, track_cols + [k for k in keys
+		if k not in track_cols])
+	if len(play_cols) != 0:
+		play_data = load_table(dataset, PLAY_PREFIX,
+			[GAME_COL, PLAY_COL] + play_cols)
+		data = pd.merge(data, play_data, on=[GAME_COL, PLAY_COL], how="left")
+	if len(game_cols) != 0:
+		game_data = load_table(dataset, GAME_PREFIX, [GAME_COL] + game_cols)
+		data = pd.merge(data, game_data, on=[GAME_COL], how="left")
+	return data[columns]
+
+def get_join_columns(track_columns, play_columns, game_columns):
+	columns = list(track_columns)
+	for table_columns in [play_columns, game_columns]:
+		for col in table_columns:
+			if col in [GAME_COL, PLAY_COL]:
+				continue
+			if col in columns:
+				raise ValueError("Column {} is in more than one table".format(col))
+			columns.append(col)
+	return columns
+
+## first phase of the two phase mode, gathers the
+## categorical values of a track file
+def scan_track(track_path):
+	data = pd.read_csv(track_path, usecols=list(TRACK_NORMALIZE_META.keys()))
+	object_cols = list(data.select_dtypes(["object"]).columns)
+	data[object_cols] = data[object_cols].fillna(NAN_VALUE)
+	values = {}
+	for col in TRACK_NORMALIZE_META:
+		value = TRACK_NORMALIZE_META[col]
+		values.setdefault(value, set()).update(data[col].unique())
+	return values
+
+## the values of all the files are added at once in sorted
+## order, so the codes do not depend on the file order
+def scan_tracks(track_paths, normalizer, jobs):
+	scans = Parallel(n_jobs=jobs)(delayed(scan_track)(path)
+		for path in track_paths)
+	for value in dict.fromkeys(TRACK_NORMALIZE_META.values()):
+		values = set().union(*[scan[value] for scan in scans])
+		appendTo(normalizer, value, list(values))
+
+def save_track(track_path, output_path, week, normalizer, frozen=False):
+	sizes = {value: len(normalizer[value]) for value in normalizer}
+	track_data = pd.read_csv(track_path)
+	track_data = normalize_track(track_data, normalizer)
+	if frozen and sizes != {value: len(normalizer[value])
+		for value in normalizer}:
+		raise ValueError("Track file {} has values missing in the scanned "
+			"vocabulary".format(track_path))
+	dtypes = save_table(track_data, output_path, week)
+	print("Saving track data for {} to {}".format(track_path,
+		os.path.join(output_path, week)))
+	return dtypes, list(track_data.columns)
+
+def get_dataframes(data_path, output_path, two_phase, jobs):
 	normalizer = {}
 
 	game_path = os.path.join(data_path, "{}.csv".format(GAME_PREFIX))
@@ -179,22 +284,44 @@ def get_dataframes(data_path, output_path):
 	play_data = pd.read_csv(play_path)
 	play_data = normalize_play(play_data, normalizer)
 
+	dataset = {
+		"columns": None,
+		"weeks": [],
+		"dtypes": {
+			GAME_PREFIX: save_table(game_data, output_path, GAME_PREFIX),
+			PLAY_PREFIX: save_table(play_data, output_path, PLAY_PREFIX)
+		}
+	}
+
 	track_files = fnmatch.filter(os.listdir(data_path), "{}*.csv".format(
 		TRACK_PREFIX))
-
-	index = 0
-	for tf in track_files:
-		track_path = os.path.join(data_path, tf)
-		track_data = pd.read_csv(track_path)
-		track_data = normalize_track(track_data, normalizer)
-
-		join_data = pd.merge(track_data, play_data, on=[GAME_COL, PLAY_COL], how="left")
-		join_data = pd.merge(join_data, game_data, on=[GAME_COL], how="left")
-
-		join_output_path = os.path.join(output_path, "{}.pkl".format(index))
-		join_data.to_pickle(join_output_path)
-		index = index + 1
-		print("Saving join data for {} to {}".format(tf, join_output_path))
+	if two_phase:
+		track_files = sorted(track_files)
+	track_paths = [os.path.join(data_path, tf) for tf in track_files]
+	weeks = [os.path.splitext(tf)[0] for tf in track_files]
+
+	if two_phase:
+		scan_tracks(track_paths, normalizer, jobs)
+		print("Scanned {} track files".format(len(track_files)))
+		# every file is encoded against the frozen vocabulary
+		results = Parallel(n_jobs=jobs)(delayed(save_track)(track_path,
+			output_path, week, normalizer, frozen=True)
+			for (track_path, week) in zip(track_paths, weeks))
+	else:
+		results = [save_track(track_path, output_path, week, normalizer)
+			for (track_path, week) in zip(track_paths, weeks)]
+
+	for (week, (dtypes, track_columns)) in zip(weeks, results):
+		dataset["dtypes"][week] = dtypes
+		dataset["weeks"].append(week)
+		if dataset["columns"] is None:
+			dataset["columns"] = get_join_columns(track_columns,
+				play_data.columns, game_data.columns)
+
+	dataset_path = os.path.join(output_path, "{}.json".format(DATASET_PREFIX))
+	with open(dataset_path, "w") as output:
+		output.write(json.dumps(dataset, indent=2))
+	print("Saving dataset description to {}".format(dataset_path))
 
 	json_data = json.dumps(normalizer, indent=2)
 	normalizer_path = os.path.join(output_path, "{}.json".format(
@@ -211,6 +338,14 @@ def parse_args():
 	parser.add_argument(
 		"--output_path", type=str, help="specifies the output folder path",
 		required=True)
+	parser.add_argument(
+		"--two_phase", action="store_true",
+		help="scans the categories of all the track files before encoding them, "
+		"the codes then do not depend on the file order")
+	parser.add_argument(
+		"--jobs", type=int, default=1,
+		help="specifies the number of track files processed in parallel in the "
+		"two phase mode", required=False)
 	return vars(parser.parse_args())
 
 def main():
@@ -219,6 +354,7 @@ def main():
 	data_path = os.path.abspath(args["data_path"])
 	output_path = os.path.abspath(args["output_path"])
 
-	get_dataframes(data_path, output_path)
+	get_dataframes(data_path, output_path, args["two_phase"], args["jobs"])
 
-main()
+if __name__ == "__main__":
+	main()
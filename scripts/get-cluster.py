@@ -1,4 +1,5 @@
-import argparse, os, joblib, fnmatch, json
+import argparse, os, fnmatch, json, importlib.util
+import numpy as np
 import pandas as pd
 
 STATS_PREFIX = "week"
@@ -10,32 +11,139 @@ ONLY_CLOSEST_KEY = "only_closest"
 CLOSE_TO_BR_KEY = "close_to_br"
 GROUP_BY = ["gameId", "playId"]
 MAX_COL = "closest_frames"
+CONFIG_FILE = "config.json"
+MODEL_SCRIPT = "gmm-model.py"
 
-def get_cluster(gmm, config, data_folder, output_folder):
+def load_script(filename):
+	path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+	name = os.path.splitext(filename)[0].replace("-", "_")
+	spec = importlib.util.spec_from_file_location(name, path)
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module
+
+gm = load_script(MODEL_SCRIPT)
+
+def score_data(gmm, config, data):
+	x = gm.get_matrix(gmm, data.drop(config[SKIP_COLS_KEY], axis = 1,
+		errors="ignore"))
+	# rows with a missing feature have no cluster, they are left out as they
+	# are when training in run-gmm.py
+	missing = np.isnan(x).any(axis=1)
+	if missing.any():
+		print("Skipping {} rows with missing features".format(missing.sum()))
+		x = x[~missing]
+		data = data[~missing]
+	output_data = data[COLS_TO_ADD].copy()
+	n_components = len(gmm["weights"])
+	prob_keys = ["{}{}".format(PROB_KEY_PREFIX, i)
+		for i in range(n_components)]
+	if len(x) == 0:
+		y_prob = np.empty((0, n_components))
+	else:
+		# single E-step, the cluster is the most probable component
+		y_prob = gm.predict_proba(gmm, x)
+	output_data[CLUSTER_KEY] = y_prob.argmax(axis=1)
+	prob_data = pd.DataFrame(y_prob, index=output_data.index, columns=prob_keys)
+	return pd.concat([output_data, prob_data], axis=1)
+
+def get_cluster_for_data(gmm, config, data):
+	if config[ONLY_CLOSEST_KEY] == 1:
+		data = data.loc[data.groupby(GROUP_BY)[MAX_COL].idxmax()].reset_index(
+			drop=True)
+	elif len(config[CLOSE_TO_BR_KEY]) != 0:
+		data = data[data[CLOSE_TO_BR_KEY].isin(config[CLOSE_TO_BR_KEY])]
+	return score_data(gmm, config, data)
+
+def get_closest_rows(file_path):
+	# only the group columns are read, the row positions are in the
+	# sorted group order used by the in memory filter
+	data = pd.read_csv(file_path, usecols=GROUP_BY + [MAX_COL])
+	return data.groupby(GROUP_BY)[MAX_COL].idxmax().values
+
+def write_scores(model, data, output_file, header, chunk_size):
+	for start in range(0, max(len(data), 1), chunk_size):
+		output_data = score_data(model["gmm"], model["config"],
+			data.iloc[start:start + chunk_size])
+		output_data.to_csv(output_file, header=header,
+			mode="w" if header else "a")
+		header = False
+	return header
+
+def get_used_columns(models, file_path):
+	# the columns kept by one of the models and the ones needed for the rows
+	header = pd.read_csv(file_path, nrows=0).columns
+	keep = COLS_TO_ADD + GROUP_BY + [MAX_COL, CLOSE_TO_BR_KEY]
+	for m in models:
+		keep += list(header.drop(models[m]["config"][SKIP_COLS_KEY],
+			errors="ignore"))
+	return [col for col in header if col in keep]
+
+def get_cluster_for_file(models, f, file_path, chunk_size):
+	# the stats file is read once and scored by every model
+	closest_models = [m for m in models
+		if models[m]["config"][ONLY_CLOSEST_KEY] == 1]
+	closest_rows = None if len(closest_models) == 0 else \
+		get_closest_rows(file_path)
+	closest_chunks = []
+	headers = {m: True for m in models}
+	for chunk in pd.read_csv(file_path, chunksize=chunk_size,
+		usecols=get_used_columns(models, file_path)):
+		if closest_rows is not None:
+			# one row per play is kept, gather them before scoring
+			closest_chunks.append(chunk[chunk.index.isin(closest_rows)])
+		for m in models:
+			config = models[m]["config"]
+			if config[ONLY_CLOSEST_KEY] == 1:
+				continue
+			data = chunk
+			if len(config[CLOSE_TO_BR_KEY]) != 0:
+				data = data[data[CLOSE_TO_BR_KEY].isin(config[CLOSE_TO_BR_KEY])]
+			output_file = os.path.join(models[m]["output_folder"], f)
+			headers[m] = write_scores(models[m], data, output_file, headers[m],
+				chunk_size)
+	if closest_rows is None:
+		return
+	data = pd.concat(closest_chunks).loc[closest_rows].reset_index(drop=True)
+	for m in closest_models:
+		output_file = os.path.join(models[m]["output_folder"], f)
+		write_scores(models[m], data, output_file, True, chunk_size)
+
+def get_cluster(models, data_folder, chunk_size):
 	stats_files = fnmatch.filter(os.listdir(data_folder), "{}*.csv".format(
 		STATS_PREFIX))
 	for f in stats_files:
 		print("Processing stats file: {}".format(f))
 		file_path = os.path.join(data_folder, f)
-		data = pd.read_csv(file_path)
-		if config[ONLY_CLOSEST_KEY] == 1:
-			data = data.loc[data.groupby(GROUP_BY)[MAX_COL].idxmax()].reset_index(
-				drop=True)
-		elif len(config[CLOSE_TO_BR_KEY]) != 0:
-			data = data[data[CLOSE_TO_BR_KEY].isin(config[CLOSE_TO_BR_KEY])]
-
-		x = data.drop(config[SKIP_COLS_KEY], axis = 1)
-		y = gmm.predict(x)
-		y_prob = gmm.predict_proba(x)
-		output_data = data[COLS_TO_ADD].copy()
-		output_data[CLUSTER_KEY] = y
-		y_split = list(zip(*y_prob))
-		for i in range(len(y_split)):
-			key = "{}{}".format(PROB_KEY_PREFIX, i)
-			output_data[key] = y_split[i]
-		output_file = os.path.join(output_folder, f)
-		output_data.to_csv(output_file)
-	print("Clustering output saved to {}".format(output_folder))
+		get_cluster_for_file(models, f, file_path, chunk_size)
+	for m in models:
+		print("Clustering output saved to {}".format(
+			models[m]["output_folder"]))
+
+def load_model(config_path, gmm_path, output_folder):
+	with open(config_path) as f:
+		config = json.load(f)
+	print("Config: {}".format(config))
+	model = {
+		"gmm": gm.load_model(gmm_path),
+		"config": config,
+		"output_folder": output_folder
+	}
+	return model
+
+def load_models(model_folder, output_folder):
+	# every sub folder holding a run-gmm.py output is scored
+	models = {}
+	for name in sorted(os.listdir(model_folder)):
+		config_path = os.path.join(model_folder, name, CONFIG_FILE)
+		gmm_path = gm.get_model_path(os.path.join(model_folder, name))
+		if not (os.path.exists(config_path) and os.path.exists(gmm_path)):
+			continue
+		print("Loading model {}".format(name))
+		models[name] = load_model(config_path, gmm_path,
+			os.path.join(output_folder, name))
+		os.makedirs(models[name]["output_folder"], exist_ok=True)
+	return models
 
 def parse_args():
 	parser = argparse.ArgumentParser()
@@ -44,27 +152,48 @@ def parse_args():
 		required=True)
 	parser.add_argument(
 		"--config_path", type=str, help="specifies the path for config file",
-		required=True)
+		required=False)
 	parser.add_argument(
-		"--gmm_path", type=str, help="specifies the path for gmm joblib file",
-		required=True)
+		"--gmm_path", type=str,
+		help="specifies the path for gmm npz (or joblib) file",
+		required=False)
+	parser.add_argument(
+		"--model_path", type=str,
+		help="specifies the folder containing a run-gmm.py output folder per "
+		"model, all models are scored in one pass over the stats files",
+		required=False)
 	parser.add_argument(
 		"--output_path", type=str, help="specifies the output folder path",
 		required=True)
-	return vars(parser.parse_args())
+	parser.add_argument(
+		"--chunk_size", type=int, default=100000,
+		help="specifies the number of stats rows read and scored at a time",
+		required=False)
+	args = vars(parser.parse_args())
+	single = args["config_path"] is not None or args["gmm_path"] is not None
+	if args["model_path"] is not None and single:
+		parser.error("--model_path cannot be used with --config_path or "
+			"--gmm_path")
+	if args["model_path"] is None and \
+		(args["config_path"] is None or args["gmm_path"] is None):
+		parser.error("either --model_path or both --config_path and "
+			"--gmm_path are required")
+	return args
 
 def main():
 	args = parse_args()
 	print("Args: {}".format(args))
 	data_path = os.path.abspath(args["data_path"])
-	gmm_path = os.path.abspath(args["gmm_path"])
 	output_path = os.path.abspath(args["output_path"])
-	config_path = os.path.abspath(args["config_path"])
-	with open(config_path) as f:
-		config = json.load(f)
-	print("Config: {}".format(config))
-	gmm = joblib.load(gmm_path)
+	if args["model_path"] is not None:
+		models = load_models(os.path.abspath(args["model_path"]), output_path)
+	else:
+		models = {
+			"": load_model(os.path.abspath(args["config_path"]),
+				os.path.abspath(args["gmm_path"]), output_path)
+		}
 
-	get_cluster(gmm, config, data_path, output_path)
+	get_cluster(models, data_path, args["chunk_size"])
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+	main()
\ No newline at end of file
@@ -0,0 +1,148 @@
+import argparse, os, fnmatch, json, time, http.client, socket
+import numpy as np
+import pandas as pd
+
+# Client for gmm-server.py, clusters the stats files through the server or
+# benchmarks its throughput and latency
+
+STATS_PREFIX = "week"
+COLS_TO_ADD = ["gameId", "playId", "nflId"]
+CLUSTER_KEY = "cluster"
+PROB_KEY_PREFIX = "cluster_prob_"
+ONLY_CLOSEST_KEY = "only_closest"
+CLOSE_TO_BR_KEY = "close_to_br"
+GROUP_BY = ["gameId", "playId"]
+MAX_COL = "closest_frames"
+MODELS_PATH = "/models"
+SCORE_PATH = "/score/"
+
+def request(connection, method, path, body=None):
+	data = None if body is None else json.dumps(body)
+	headers = {} if data is None else {"Content-Type": "application/json"}
+	connection.request(method, path, body=data, headers=headers)
+	response = connection.getresponse()
+	result = json.loads(response.read())
+	if response.status != 200:
+		raise RuntimeError("Server error {}: {}".format(response.status,
+			result["error"]))
+	return result
+
+def filter_data(data, model):
+	if model[ONLY_CLOSEST_KEY] == 1:
+		data = data.loc[data.groupby(GROUP_BY)[MAX_COL].idxmax()].reset_index(
+			drop=True)
+	elif len(model[CLOSE_TO_BR_KEY]) != 0:
+		data = data[data[CLOSE_TO_BR_KEY].isin(model[CLOSE_TO_BR_KEY])]
+	return data
+
+def score_data(connection, name, data, features):
+	body = {
+		"columns": features,
+		"rows": data[features].values.tolist()
+	}
+	return request(connection, "POST", SCORE_PATH + name, body)
+
+def get_cluster(connection, name, model, data_folder, output_folder,
+	batch_size):
+	stats_files = fnmatch.filter(os.listdir(data_folder), "{}*.csv".format(
+		STATS_PREFIX))
+	for f in stats_files:
+		print("Processing stats file: {}".format(f))
+		data = filter_data(pd.read_csv(os.path.join(data_folder, f)), model)
+		clusters = []
+		probabilities = []
+		for start in range(0, len(data), batch_size):
+			result = score_data(connection, name,
+				data.iloc[start:start + batch_size], model["features"])
+			clusters += result["cluster"]
+			probabilities += result["probabilities"]
+		output_data = data[COLS_TO_ADD].copy()
+		output_data[CLUSTER_KEY] = clusters
+		prob_cols = ["{}{}".format(PROB_KEY_PREFIX, i)
+			for i in range(model["groups"])]
+		output_data[prob_cols] = np.array(probabilities).reshape(-1,
+			model["groups"])
+		output_data.to_csv(os.path.join(output_folder, f))
+	print("Clustering output saved to {}".format(output_folder))
+
+def benchmark(connection, name, model, data_folder, batch_size, requests):
+	stats_files = fnmatch.filter(os.listdir(data_folder), "{}*.csv".format(
+		STATS_PREFIX))
+	data = pd.read_csv(os.path.join(data_folder, stats_files[0]))
+	data = data.sample(n=batch_size, replace=len(data) < batch_size,
+		random_state=0)
+	latencies = []
+	server_seconds = []
+	start = time.perf_counter()
+	for _ in range(requests):
+		request_start = time.perf_counter()
+		result = score_data(connection, name, data, model["features"])
+		latencies.append(time.perf_counter() - request_start)
+		server_seconds.append(result["seconds"])
+	total = time.perf_counter() - start
+	latencies = np.array(latencies) * 1000
+	result = {
+		"model": name,
+		"batch_size": batch_size,
+		"requests": requests,
+		"rows_per_second": batch_size * requests / total,
+		"requests_per_second": requests / total,
+		"latency_ms_p50": float(np.percentile(latencies, 50)),
+		"latency_ms_p95": float(np.percentile(latencies, 95)),
+		"latency_ms_p99": float(np.percentile(latencies, 99)),
+		"server_scoring_ms_mean": float(np.mean(server_seconds) * 1000)
+	}
+	print(json.dumps(result, indent=2))
+	return result
+
+def parse_args():
+	parser = argparse.ArgumentParser()
+	parser.add_argument(
+		"--data_path", type=str, help="specifies the folder containing data files",
+		required=True)
+	parser.add_argument(
+		"--model", type=str, help="specifies the model name served by gmm-server.py",
+		required=True)
+	parser.add_argument(
+		"--output_path", type=str, help="specifies the output folder path",
+		required=False)
+	parser.add_argument(
+		"--host", type=str, default="127.0.0.1",
+		help="specifies the server host", required=False)
+	parser.add_argument(
+		"--port", type=int, default=8642,
+		help="specifies the server port", required=False)
+	parser.add_argument(
+		"--batch_size", type=int, default=1000,
+		help="specifies the number of rows sent per request", required=False)
+	parser.add_argument(
+		"--benchmark", type=int, default=0,
+		help="specifies the number of benchmark requests, 0 clusters the stats "
+		"files instead", required=False)
+	args = vars(parser.parse_args())
+	if args["benchmark"] == 0 and args["output_path"] is None:
+		parser.error("--output_path is required to cluster the stats files")
+	return args
+
+def main():
+	args = parse_args()
+	print("Args: {}".format(args))
+	data_path = os.path.abspath(args["data_path"])
+	connection = http.client.HTTPConnection(args["host"], args["port"])
+	connection.connect()
+	connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+	models = request(connection, "GET", MODELS_PATH)
+	if args["model"] not in models:
+		raise ValueError("Model {} is not served, available: {}".format(
+			args["model"], list(models.keys())))
+	model = models[args["model"]]
+
+	if args["benchmark"] > 0:
+		benchmark(connection, args["model"], model, data_path,
+			args["batch_size"], args["benchmark"])
+	else:
+		get_cluster(connection, args["model"], model, data_path,
+			os.path.abspath(args["output_path"]), args["batch_size"])
+	connection.close()
+
+main()
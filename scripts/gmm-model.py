@@ -0,0 +1,140 @@
+import argparse, os, struct, zipfile, joblib
+import numpy as np
+
+# Saves the parameters of a fitted GaussianMixture in an uncompressed npz file
+# next to the pickled model. The npz file is loaded memory mapped and scored
+# with numpy only, so scoring does not depend on the sklearn version the model
+# was fitted with
+
+MODEL_FILE = "gmm.npz"
+GMM_FILE = "gmm.joblib"
+COVARIANCE_TYPE = "full"
+ZIP_HEADER_SIZE = 30
+
+def from_sklearn(gmm):
+	if gmm.covariance_type != COVARIANCE_TYPE:
+		raise ValueError("Only {} covariance models are supported, not {}".format(
+			COVARIANCE_TYPE, gmm.covariance_type))
+	features = None if not hasattr(gmm, "feature_names_in_") else \
+		[str(f) for f in gmm.feature_names_in_]
+	model = {
+		"weights": gmm.weights_,
+		"means": gmm.means_,
+		"covariances": gmm.covariances_,
+		"precisions_cholesky": gmm.precisions_cholesky_,
+		"features": features
+	}
+	return model
+
+def export_gmm(gmm, output_path):
+	model = from_sklearn(gmm)
+	features = [] if model["features"] is None else model["features"]
+	np.savez(output_path, weights=model["weights"], means=model["means"],
+		covariances=model["covariances"],
+		precisions_cholesky=model["precisions_cholesky"],
+		features=np.array(features, dtype=str))
+
+def load_member(path, info):
+	# a stored npz member is a npy file at a fixed offset of the zip file
+	with open(path, "rb") as f:
+		f.seek(info.header_offset)
+		(name_length, extra_length) = struct.unpack("<HH",
+			f.read(ZIP_HEADER_SIZE)[26:30])
+		f.seek(info.header_offset + ZIP_HEADER_SIZE + name_length + extra_length)
+		version = np.lib.format.read_magic(f)
+		read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) \
+			else np.lib.format.read_array_header_2_0
+		(shape, fortran_order, dtype) = read_header(f)
+		offset = f.tell()
+	if np.prod(shape) == 0:
+		return np.empty(shape, dtype=dtype)
+	return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape,
+		order="F" if fortran_order else "C")
+
+def load_gmm(model_path):
+	arrays = {}
+	with zipfile.ZipFile(model_path) as archive:
+		for info in archive.infolist():
+			name = os.path.splitext(info.filename)[0]
+			if info.compress_type == zipfile.ZIP_STORED:
+				arrays[name] = load_member(model_path, info)
+			else:
+				with archive.open(info) as f:
+					arrays[name] = np.lib.format.read_array(f)
+	model = {
+		"weights": arrays["weights"],
+		"means": arrays["means"],
+		"covariances": arrays["covariances"],
+		"precisions_cholesky": arrays["precisions_cholesky"],
+		"features": None if len(arrays["features"]) == 0 else \
+			[str(f) for f in arrays["features"]]
+	}
+	return model
+
+def get_model_path(model_folder):
+	# the npz parameters are preferred to the pickled model
+	model_path = os.path.join(model_folder, MODEL_FILE)
+	if not os.path.exists(model_path):
+		model_path = os.path.join(model_folder, GMM_FILE)
+	return model_path
+
+def load_model(model_path):
+	# the npz parameters, or the parameters of the pickled model
+	if model_path.endswith(".npz"):
+		return load_gmm(model_path)
+	return from_sklearn(joblib.load(model_path))
+
+def get_matrix(model, x):
+	if model["features"] is not None and hasattr(x, "columns"):
+		x = x[model["features"]]
+	return np.asarray(x, dtype=np.float64)
+
+def estimate_weighted_log_prob(model, x):
+	# same as sklearn for "full" covariance, the log density of every
+	# component plus the log of its weight
+	(n_components, n_features) = model["means"].shape
+	precisions_chol = model["precisions_cholesky"]
+	log_prob = np.empty((len(x), n_components))
+	for k in range(n_components):
+		y = np.dot(x, precisions_chol[k]) - np.dot(model["means"][k],
+			precisions_chol[k])
+		log_prob[:, k] = np.sum(np.square(y), axis=1)
+	log_det = np.sum(np.log(np.diagonal(precisions_chol, axis1=1, axis2=2)),
+		axis=1)
+	return -0.5 * (n_features * np.log(2 * np.pi) + log_prob) + log_det + \
+		np.log(model["weights"])
+
+def predict_proba(model, x):
+	x = get_matrix(model, x)
+	# a missing feature would give nan probabilities and cluster 0
+	if np.isnan(x).any():
+		raise ValueError("Input contains NaN, {} rows have missing "
+			"features".format(np.isnan(x).any(axis=1).sum()))
+	weighted = estimate_weighted_log_prob(model, x)
+	top = weighted.max(axis=1, keepdims=True)
+	log_norm = top + np.log(np.sum(np.exp(weighted - top), axis=1,
+		keepdims=True))
+	return np.exp(weighted - log_norm)
+
+def predict(model, x):
+	return predict_proba(model, x).argmax(axis=1)
+
+def parse_args():
+	parser = argparse.ArgumentParser()
+	parser.add_argument(
+		"--model_path", type=str, nargs="+",
+		help="specifies the run-gmm.py output folders whose gmm.joblib files are "
+		"exported to gmm.npz", required=True)
+	return vars(parser.parse_args())
+
+def main():
+	args = parse_args()
+	print("Args: {}".format(args))
+	for model_folder in args["model_path"]:
+		model_folder = os.path.abspath(model_folder)
+		output_path = os.path.join(model_folder, MODEL_FILE)
+		export_gmm(joblib.load(os.path.join(model_folder, GMM_FILE)), output_path)
+		print("GMM parameters saved to {}".format(output_path))
+
+if __name__ == "__main__":
+	main()
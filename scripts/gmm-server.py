@@ -0,0 +1,165 @@
+import argparse, os, json, time, importlib.util
+import numpy as np
+import pandas as pd
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Keeps the gmm models generated by run-gmm.py loaded and scores batches of
+# stats rows sent over localhost http, see gmm-client.py
+
+SKIP_COLS_KEY = "global_skip_cols"
+ONLY_CLOSEST_KEY = "only_closest"
+CLOSE_TO_BR_KEY = "close_to_br"
+CONFIG_FILE = "config.json"
+MODELS_PATH = "/models"
+SCORE_PATH = "/score/"
+MODEL_SCRIPT = "gmm-model.py"
+
+def load_script(filename):
+	path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+	name = os.path.splitext(filename)[0].replace("-", "_")
+	spec = importlib.util.spec_from_file_location(name, path)
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module
+
+gm = load_script(MODEL_SCRIPT)
+
+def load_model(model_folder):
+	with open(os.path.join(model_folder, CONFIG_FILE)) as f:
+		config = json.load(f)
+	# the same model file as get-cluster.py scores
+	gmm = gm.load_model(gm.get_model_path(model_folder))
+	# the requests are validated against the feature names, a model saved
+	# without them cannot be served
+	if gmm["features"] is None:
+		raise ValueError("The model in {} has no feature names, refit it with "
+			"run-gmm.py".format(model_folder))
+	for key in [SKIP_COLS_KEY, ONLY_CLOSEST_KEY, CLOSE_TO_BR_KEY]:
+		if key not in config:
+			raise ValueError("The config of {} has no {}".format(model_folder,
+				key))
+	model = {
+		"gmm": gmm,
+		"config": config,
+		"features": gmm["features"]
+	}
+	return model
+
+def load_models(model_folders):
+	models = {}
+	for folder in model_folders:
+		name = os.path.basename(os.path.normpath(folder))
+		print("Loading model {} from {}".format(name, folder))
+		models[name] = load_model(folder)
+	return models
+
+def describe_models(models):
+	description = {}
+	for name in models:
+		model = models[name]
+		description[name] = {
+			"groups": len(model["gmm"]["weights"]),
+			"features": model["features"],
+			ONLY_CLOSEST_KEY: model["config"][ONLY_CLOSEST_KEY],
+			CLOSE_TO_BR_KEY: model["config"][CLOSE_TO_BR_KEY],
+			SKIP_COLS_KEY: model["config"][SKIP_COLS_KEY]
+		}
+	return description
+
+def score(model, request):
+	if not isinstance(request, dict):
+		raise ValueError("The request should be a json object with records, "
+			"or rows and columns")
+	if "records" in request:
+		data = pd.DataFrame(request["records"])
+	else:
+		data = pd.DataFrame(request["rows"], columns=request["columns"])
+	x = data[model["features"]].astype(np.float64)
+	# one E-step, the cluster is the most probable component
+	y_prob = gm.predict_proba(model["gmm"], x)
+	result = {
+		"cluster": y_prob.argmax(axis=1).tolist(),
+		"probabilities": y_prob.tolist()
+	}
+	return result
+
+class ScoringHandler(BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+	# headers and body are written separately, avoid waiting on delayed acks
+	disable_nagle_algorithm = True
+
+	def send_json(self, status, body):
+		data = json.dumps(body).encode("utf-8")
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def do_GET(self):
+		if self.path != MODELS_PATH:
+			self.send_json(404, {"error": "unknown path {}".format(self.path)})
+			return
+		self.send_json(200, describe_models(self.server.models))
+
+	def do_POST(self):
+		length = int(self.headers.get("Content-Length", 0))
+		body = self.rfile.read(length)
+		if not self.path.startswith(SCORE_PATH):
+			self.send_json(404, {"error": "unknown path {}".format(self.path)})
+			return
+		name = self.path[len(SCORE_PATH):]
+		if name not in self.server.models:
+			self.send_json(404, {"error": "unknown model {}".format(name)})
+			return
+		try:
+			start = time.perf_counter()
+			result = score(self.server.models[name], json.loads(body))
+			result["seconds"] = time.perf_counter() - start
+		except (ValueError, KeyError, TypeError) as e:
+			self.send_json(400, {"error": str(e)})
+			return
+		self.send_json(200, result)
+
+	def log_message(self, format, *args):
+		if self.server.verbose:
+			super().log_message(format, *args)
+
+def serve(models, host, port, verbose):
+	server = ThreadingHTTPServer((host, port), ScoringHandler)
+	server.models = models
+	server.verbose = verbose
+	print("Serving models {} on http://{}:{}".format(list(models.keys()),
+		host, port))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	server.server_close()
+
+def parse_args():
+	parser = argparse.ArgumentParser()
+	parser.add_argument(
+		"--model_path", type=str, nargs="+",
+		help="specifies the model folders generated by run-gmm.py",
+		required=True)
+	parser.add_argument(
+		"--host", type=str, default="127.0.0.1",
+		help="specifies the host to listen on", required=False)
+	parser.add_argument(
+		"--port", type=int, default=8642,
+		help="specifies the port to listen on", required=False)
+	parser.add_argument(
+		"--verbose", action="store_true",
+		help="logs every request", required=False)
+	return vars(parser.parse_args())
+
+def main():
+	args = parse_args()
+	print("Args: {}".format(args))
+	model_paths = [os.path.abspath(p) for p in args["model_path"]]
+	models = load_models(model_paths)
+
+	serve(models, args["host"], args["port"], args["verbose"])
+
+main()
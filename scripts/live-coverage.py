@@ -0,0 +1,359 @@
+import argparse, os, fnmatch, json, math, time, importlib.util, joblib
+import numpy as np
+import pandas as pd
+
+# Classifies the coverage of the defenders while a play is replayed, frame by
+# frame. The window stats of compute-tracking-stats.py are kept as online
+# (Welford) accumulators, so every frame costs the same however long the play
+
+TRACKING_STATS_SCRIPT = "compute-tracking-stats.py"
+TRACK_PREFIX = "week"
+CONFIG_FILE = "config.json"
+GMM_FILE = "gmm.joblib"
+SKIP_COLS_KEY = "global_skip_cols"
+ONLY_CLOSEST_KEY = "only_closest"
+CLOSE_TO_BR_KEY = "close_to_br"
+CLUSTER_KEY = "cluster"
+PROB_KEY_PREFIX = "cluster_prob_"
+LATENCY_KEY = "latency_ms"
+REPLAY_RATE = 10
+
+BEFORE_SNAP = 0
+BETWEEN_SNAP_PASS = 1
+AFTER_PASS = 2
+
+def load_script(filename):
+	path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+	name = os.path.splitext(filename)[0].replace("-", "_")
+	spec = importlib.util.spec_from_file_location(name, path)
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module
+
+ct = load_script(TRACKING_STATS_SCRIPT)
+
+STAT_FIELDS = [(ct.S_X, ct.A_X), (ct.S_Y, ct.A_Y), (ct.S_SPEED, ct.A_S),
+	(ct.S_DIST_OFF, ct.A_DO), (ct.S_DIST_DEF, ct.A_DD),
+	(ct.S_DIR_OFF, ct.A_DIRO)]
+# same order as set_mean_variance, so the features line up with the stats files
+WINDOWS = [ct.A_BS_PREFIX, ct.A_AS_PREFIX, ct.A_BSP_PREFIX, ct.A_BP_PREFIX,
+	ct.A_AP_PREFIX, ct.A_FULL_PREFIX]
+PHASE_WINDOWS = {
+	BEFORE_SNAP: [ct.A_BS_PREFIX, ct.A_BP_PREFIX, ct.A_FULL_PREFIX],
+	BETWEEN_SNAP_PASS: [ct.A_AS_PREFIX, ct.A_BSP_PREFIX, ct.A_BP_PREFIX,
+		ct.A_FULL_PREFIX],
+	AFTER_PASS: [ct.A_AS_PREFIX, ct.A_AP_PREFIX, ct.A_FULL_PREFIX]
+}
+
+def new_accumulator():
+	# count, mean, sum of squared differences from the mean
+	return [0, 0.0, 0.0]
+
+def update_accumulator(acc, value):
+	acc[0] += 1
+	delta = value - acc[1]
+	acc[1] += delta / acc[0]
+	acc[2] += delta * (value - acc[1])
+
+def get_mean_variance(acc):
+	if acc[0] == 0:
+		return 0, 0
+	return acc[1], acc[2] / acc[0]
+
+def new_player_state():
+	return {
+		"phase": BEFORE_SNAP,
+		"stats": {(w, name): new_accumulator() for (_, name) in STAT_FIELDS
+			for w in WINDOWS},
+		"ratio": new_accumulator(),
+		"ratio_between": [],
+		"closest_frames": 0,
+		"br_close": 0,
+		"not_cb": 0
+	}
+
+def update_player_state(state, values):
+	event = values[ct.S_EVENT]
+	if state["phase"] == BEFORE_SNAP and event == ct.SNAP_EVENT:
+		state["phase"] = BETWEEN_SNAP_PASS
+	phase = state["phase"]
+	for (stat, name) in STAT_FIELDS:
+		if not ct.is_valid(values[stat]):
+			continue
+		for w in PHASE_WINDOWS[phase]:
+			update_accumulator(state["stats"][(w, name)], values[stat])
+	num = values[ct.S_DIST_OFF]
+	den = values[ct.S_DIST_OFF_DEF]
+	ratio = ct.get_ratio_value(num, den)
+	if ct.is_valid(num) and ct.is_valid(den) and den != 0:
+		update_accumulator(state["ratio"], ratio)
+	if phase == BETWEEN_SNAP_PASS:
+		# at snap, at mid and at pass ratios are read from this window
+		state["ratio_between"].append(ratio)
+		if event in ct.PASS_EVENTS:
+			state["phase"] = AFTER_PASS
+	state["closest_frames"] += values[ct.S_FB_CLOSEST]
+	state["br_close"] += values[ct.S_BR_CLOSE]
+	state["not_cb"] = max(state["not_cb"], values[ct.S_NOT_CB])
+
+def get_player_features(state, player, game, play):
+	features = {
+		ct.NFL_ID: player,
+		ct.GAME_ID: game,
+		ct.PLAY_ID: play,
+		ct.A_CLOSEST: state["closest_frames"]
+	}
+	for (_, name) in STAT_FIELDS:
+		for w in WINDOWS:
+			mean, variance = get_mean_variance(state["stats"][(w, name)])
+			features[w + ct.A_MEAN_PREFIX + name] = mean
+			features[w + ct.A_VAR_PREFIX + name] = variance
+	mean, variance = get_mean_variance(state["ratio"])
+	between = state["ratio_between"]
+	mid_index = math.ceil(len(between) / 2) - 1
+	features[ct.A_FULL_PREFIX + ct.A_MEAN_PREFIX + ct.A_R] = mean
+	features[ct.A_FULL_PREFIX + ct.A_VAR_PREFIX + ct.A_R] = variance
+	features[ct.A_S_PREFIX + ct.A_R] = between[0] if len(between) > 0 else 0
+	features[ct.A_P_PREFIX + ct.A_R] = between[-1] if len(between) > 0 else 0
+	features[ct.A_M_PREFIX + ct.A_R] = between[mid_index] \
+		if len(between) > 0 else 0
+	return features
+
+def new_play_state(common_data, br_data, game, play, validate):
+	return {
+		"game": game,
+		"play": play,
+		"common_stats": ct.compute_common_stats(common_data, game, play),
+		"br_info": ct.get_ball_receiver_info(br_data, game, play),
+		"players": {},
+		# the per frame stats, only kept to check against the batch stats
+		"history": {} if validate else None
+	}
+
+def update_play_state(state, frame_data, frame):
+	frame_stats = ct.get_stats_for_frame(frame_data, state["common_stats"], {},
+		frame, state["br_info"])
+	for player in frame_stats:
+		values = {s: frame_stats[player][s][0] for s in frame_stats[player]}
+		if player not in state["players"]:
+			state["players"][player] = new_player_state()
+		update_player_state(state["players"][player], values)
+		if state["history"] is not None:
+			if player not in state["history"]:
+				state["history"][player] = ct.get_empty_stats()
+			ct.append_stats(state["history"][player], values)
+
+def get_play_features(state):
+	# close to ball receiver type as assigned by gather_frame_stats
+	not_cb_player = None
+	cb_closest_to_br = None
+	cb_closest_max_value = -1
+	features = {}
+	for player in state["players"]:
+		player_state = state["players"][player]
+		features[player] = get_player_features(player_state, player,
+			state["game"], state["play"])
+		if player_state["not_cb"] == 1:
+			not_cb_player = player
+		elif player_state["br_close"] > cb_closest_max_value:
+			cb_closest_max_value = player_state["br_close"]
+			cb_closest_to_br = player
+	for player in features:
+		br_closeness_type = ct.A_VAL_BR_NOT_CLOSE
+		if player == cb_closest_to_br:
+			br_closeness_type = ct.A_VAL_BR_CLOSE_CB_DEF if not_cb_player is None \
+				else ct.A_VAL_BR_CLOSE_CB
+		elif player == not_cb_player:
+			br_closeness_type = ct.A_VAL_BR_CLOSE_DEF
+		features[player][ct.A_BR_CLOSEST] = br_closeness_type
+	return features
+
+def select_players(config, features):
+	players = list(features)
+	if len(players) == 0:
+		return players
+	if config[ONLY_CLOSEST_KEY] == 1:
+		return [max(players, key=lambda p: features[p][ct.A_CLOSEST])]
+	if len(config[CLOSE_TO_BR_KEY]) != 0:
+		return [p for p in players
+			if features[p][ct.A_BR_CLOSEST] in config[CLOSE_TO_BR_KEY]]
+	return players
+
+def classify(model, features, frame):
+	players = select_players(model["config"], features)
+	if len(players) == 0:
+		return []
+	x = pd.DataFrame([[features[p][c] for c in model["features"]]
+		for p in players], columns=model["features"])
+	y_prob = model["gmm"].predict_proba(x)
+	rows = []
+	for (p, prob) in zip(players, y_prob):
+		row = {
+			ct.GAME_ID: features[p][ct.GAME_ID],
+			ct.PLAY_ID: features[p][ct.PLAY_ID],
+			ct.FRAME_ID: frame,
+			ct.NFL_ID: p,
+			CLUSTER_KEY: int(prob.argmax())
+		}
+		for i in range(len(prob)):
+			row["{}{}".format(PROB_KEY_PREFIX, i)] = prob[i]
+		rows.append(row)
+	return rows
+
+def check_play_state(state):
+	# largest difference between the online features and the batch stats
+	batch = ct.gather_frame_stats(state["history"], state["game"],
+		state["play"])
+	if len(batch) == 0:
+		return 0
+	features = get_play_features(state)
+	online = pd.DataFrame([features[p] for p in batch[ct.NFL_ID]])
+	return float(np.abs(online[batch.columns].values.astype(float) -
+		batch.values.astype(float)).max())
+
+def replay_play(model, play_data, game, play, common_data, br_data, rate,
+	validate):
+	state = new_play_state(common_data, br_data, game, play, validate)
+	frames = [(frame, frame_data) for (frame, frame_data) in
+		play_data.groupby(ct.FRAME_ID)]
+	interval = 0 if rate <= 0 else 1 / rate
+	rows = []
+	latencies = []
+	start = time.perf_counter()
+	for (i, (frame, frame_data)) in enumerate(frames):
+		# frames arrive at the replay rate, a frame still waiting on the
+		# previous one counts the wait in its latency
+		due = start + i * interval
+		wait = due - time.perf_counter()
+		if wait > 0:
+			time.sleep(wait)
+		arrival = due if interval > 0 else time.perf_counter()
+		update_play_state(state, frame_data, frame)
+		frame_rows = classify(model, get_play_features(state), frame)
+		latency = (time.perf_counter() - arrival) * 1000
+		for row in frame_rows:
+			row[LATENCY_KEY] = latency
+		rows.extend(frame_rows)
+		latencies.append(latency)
+	difference = check_play_state(state) if validate else None
+	return rows, latencies, difference
+
+def replay_file(model, filename, data_folder, output_folder, common_data,
+	br_data, args):
+	data = pd.read_csv(os.path.join(data_folder, filename))
+	if args["game"] is not None:
+		data = data[data[ct.GAME_ID] == args["game"]]
+	if args["play"] is not None:
+		data = data[data[ct.PLAY_ID] == args["play"]]
+	plays = sorted(data.groupby([ct.GAME_ID, ct.PLAY_ID]).groups.keys())
+	if args["max_plays"] is not None:
+		plays = plays[:args["max_plays"]]
+	rows = []
+	latencies = []
+	max_difference = 0
+	for (game, play) in plays:
+		print("Replaying game {} play {} ...".format(game, play))
+		play_data = data[(data[ct.GAME_ID] == game) & (data[ct.PLAY_ID] == play)]
+		play_rows, play_latencies, difference = replay_play(model, play_data,
+			game, play, common_data, br_data, args["rate"], args["validate"])
+		rows.extend(play_rows)
+		latencies.extend(play_latencies)
+		if difference is not None:
+			max_difference = max(max_difference, difference)
+	pd.DataFrame(rows).to_csv(os.path.join(output_folder, filename))
+	if len(latencies) == 0:
+		return
+	latencies = np.array(latencies)
+	budget = 1000 / args["rate"] if args["rate"] > 0 else None
+	result = {
+		"file": filename,
+		"plays": len(plays),
+		"frames": len(latencies),
+		"latency_ms_mean": float(latencies.mean()),
+		"latency_ms_p50": float(np.percentile(latencies, 50)),
+		"latency_ms_p95": float(np.percentile(latencies, 95)),
+		"latency_ms_p99": float(np.percentile(latencies, 99)),
+		"latency_ms_max": float(latencies.max()),
+		"frames_over_budget": None if budget is None else
+			int((latencies > budget).sum())
+	}
+	if args["validate"]:
+		result["max_difference_from_batch_stats"] = max_difference
+	print(json.dumps(result, indent=2))
+
+def load_model(model_folder):
+	with open(os.path.join(model_folder, CONFIG_FILE)) as f:
+		config = json.load(f)
+	gmm = joblib.load(os.path.join(model_folder, GMM_FILE))
+	if not hasattr(gmm, "feature_names_in_"):
+		raise ValueError("Model {} has no feature names, retrain it with "
+			"run-gmm.py".format(model_folder))
+	print("Model loaded from {}".format(model_folder))
+	return {"gmm": gmm, "config": config,
+		"features": list(gmm.feature_names_in_)}
+
+def replay(model, data_folder, output_folder, br_data, args):
+	game_file = os.path.join(data_folder, "{}.csv".format(ct.GAME_FILE))
+	play_file = os.path.join(data_folder, "{}.csv".format(ct.PLAY_FILE))
+	game_data = pd.read_csv(game_file)
+	play_data = pd.read_csv(play_file)
+	common_data = pd.merge(play_data, game_data, on=[ct.GAME_ID], how="left")
+
+	track_files = sorted(fnmatch.filter(os.listdir(data_folder),
+		"{}*.csv".format(TRACK_PREFIX)))
+	if args["week_file"] is not None:
+		track_files = [args["week_file"]]
+	for tf in track_files:
+		print("Working on file {} ...".format(tf))
+		replay_file(model, tf, data_folder, output_folder, common_data, br_data,
+			args)
+
+def parse_args():
+	parser = argparse.ArgumentParser()
+	parser.add_argument(
+		"--data_path", type=str, help="specifies the folder containing data files",
+		required=True)
+	parser.add_argument(
+		"--output_path", type=str, help="specifies the output folder path",
+		required=True)
+	parser.add_argument(
+		"--model_path", type=str,
+		help="specifies the output folder of run-gmm.py with the model to score",
+		required=True)
+	parser.add_argument(
+		"--br_path", type=str, help="specifies the folder containing ball receiver data",
+		required=False)
+	parser.add_argument(
+		"--week_file", type=str, help="specifies the only tracking file to replay",
+		required=False)
+	parser.add_argument(
+		"--game", type=int, help="specifies the only game to replay",
+		required=False)
+	parser.add_argument(
+		"--play", type=int, help="specifies the only play to replay",
+		required=False)
+	parser.add_argument(
+		"--max_plays", type=int, help="specifies the maximum plays replayed per file",
+		required=False)
+	parser.add_argument(
+		"--rate", type=float, default=REPLAY_RATE,
+		help="specifies the frames fed per second, 0 feeds them without pause",
+		required=False)
+	parser.add_argument(
+		"--validate", action="store_true",
+		help="checks the online stats against compute-tracking-stats.py at the "
+		"end of every play")
+	return vars(parser.parse_args())
+
+def main():
+	args = parse_args()
+	print("Args: {}".format(args))
+	data_path = os.path.abspath(args["data_path"])
+	output_path = os.path.abspath(args["output_path"])
+	model = load_model(os.path.abspath(args["model_path"]))
+	br_data = ct.ball_receiver_data(args)
+
+	replay(model, data_path, output_path, br_data, args)
+
+if __name__ == "__main__":
+	main()
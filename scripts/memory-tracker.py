@@ -0,0 +1,139 @@
+import os, json, time, tracemalloc, linecache
+from contextlib import contextmanager
+
+# Memory tracking shared by compute-tracking-stats.py and run-gmm.py, loaded
+# as a module. Every stage reports its peak RSS and, when profiling, the
+# tracemalloc peak and largest allocation sites
+
+STATUS_FILE = "/proc/self/status"
+CLEAR_REFS_FILE = "/proc/self/clear_refs"
+RSS_FIELD = "VmRSS"
+PEAK_RSS_FIELD = "VmHWM"
+# writing 5 to clear_refs resets the peak RSS of the process
+RESET_PEAK_VALUE = "5"
+TRACE_FRAMES = 1
+TOP_SITES = 10
+MB = 1024 * 1024
+
+def read_status(field):
+	try:
+		with open(STATUS_FILE) as f:
+			for line in f:
+				if line.startswith("{}:".format(field)):
+					return int(line.split()[1]) * 1024
+	except OSError:
+		pass
+	return None
+
+def get_peak_rss():
+	peak = read_status(PEAK_RSS_FIELD)
+	if peak is not None:
+		return peak
+	import resource
+	# kilobytes on linux, bytes on macos
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+def get_rss():
+	rss = read_status(RSS_FIELD)
+	return get_peak_rss() if rss is None else rss
+
+def reset_peak_rss():
+	# without it the peak of a stage is the process peak so far
+	try:
+		with open(CLEAR_REFS_FILE, "w") as f:
+			f.write(RESET_PEAK_VALUE)
+	except OSError:
+		pass
+
+def new_tracker(profile=False, limit_mb=None):
+	if profile and not tracemalloc.is_tracing():
+		tracemalloc.start(TRACE_FRAMES)
+	tracker = {
+		"profile": profile,
+		"limit": None if limit_mb is None else int(limit_mb * MB),
+		"stages": []
+	}
+	return tracker
+
+def get_top_sites(snapshot):
+	# leaves out the memory used by the tracing itself
+	snapshot = snapshot.filter_traces([
+		tracemalloc.Filter(False, tracemalloc.__file__),
+		tracemalloc.Filter(False, linecache.__file__)
+	])
+	sites = []
+	for stat in snapshot.statistics("lineno")[:TOP_SITES]:
+		frame = stat.traceback[0]
+		sites.append({
+			"site": "{}:{}".format(os.path.basename(frame.filename), frame.lineno),
+			"size_mb": stat.size / MB,
+			"count": stat.count
+		})
+	return sites
+
+## the top allocation sites are the ones still holding memory at the
+## end of the stage, a stage that fails is recorded with its error
+@contextmanager
+def stage(tracker, name):
+	reset_peak_rss()
+	if tracker["profile"]:
+		tracemalloc.reset_peak()
+	start = time.time()
+	rss_start = get_rss()
+	error = None
+	try:
+		yield
+	except BaseException as e:
+		error = "{}: {}".format(type(e).__name__, e)
+		raise
+	finally:
+		result = {
+			"name": name,
+			"seconds": time.time() - start,
+			"rss_start_mb": rss_start / MB,
+			"rss_end_mb": get_rss() / MB,
+			"peak_rss_mb": get_peak_rss() / MB
+		}
+		if error is not None:
+			result["error"] = error
+		if tracker["profile"]:
+			result["traced_peak_mb"] = tracemalloc.get_traced_memory()[1] / MB
+			result["top_sites"] = get_top_sites(tracemalloc.take_snapshot())
+		tracker["stages"].append(result)
+		print("Memory of stage {}: peak rss {:.1f} MB, rss {:.1f} MB -> {:.1f} "
+			"MB{}".format(name, result["peak_rss_mb"], result["rss_start_mb"],
+			result["rss_end_mb"], "" if error is None else ", failed"))
+
+def get_budget(tracker):
+	# the bytes left under the memory limit, None without a limit
+	if tracker["limit"] is None:
+		return None
+	return tracker["limit"] - get_rss()
+
+def check_budget(tracker, needed, what):
+	budget = get_budget(tracker)
+	if budget is not None and needed > budget:
+		raise MemoryError("{} needs about {:.1f} MB, only {:.1f} MB are left "
+			"under the memory limit of {:.1f} MB".format(what, needed / MB,
+			max(budget, 0) / MB, tracker["limit"] / MB))
+
+@contextmanager
+def report_on_error(tracker, output_folder):
+	# a failed run saves the stages recorded so far when profiling
+	try:
+		yield
+	except BaseException:
+		if tracker["profile"]:
+			save_report(tracker, output_folder)
+		raise
+
+def save_report(tracker, output_folder):
+	output_path = os.path.join(output_folder, "memory.json")
+	report = {
+		"limit_mb": None if tracker["limit"] is None else tracker["limit"] / MB,
+		"stages": tracker["stages"]
+	}
+	with open(output_path, "w") as output:
+		output.write(json.dumps(report, indent=2))
+	print("Memory report saved to {}".format(output_path))
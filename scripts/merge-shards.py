@@ -0,0 +1,159 @@
+import argparse, os, json, hashlib, re
+import pandas as pd
+
+# Games are split in shards on a stable hash of their id, so that the shards
+# of find-ball-receiver.py and compute-tracking-stats.py can run on separate
+# machines. Every shard writes its files in a shard-<i>-of-<n> folder with a
+# manifest of the games it has covered, and this script merges the shard files
+# into the files a single run writes
+
+GAME_ID = "gameId"
+SHARD_FOLDER = "shard-{}-of-{}"
+SHARD_PATTERN = re.compile(r"^shard-(\d+)-of-(\d+)$")
+MANIFEST_FILE = "shard.json"
+
+def parse_shard(value):
+	# "i/n", the shard index i counts from 0
+	match = re.match(r"^(\d+)/(\d+)$", value)
+	if match is None or int(match.group(1)) >= int(match.group(2)):
+		raise argparse.ArgumentTypeError("{} is not a shard i/n with "
+			"0 <= i < n".format(value))
+	return (int(match.group(1)), int(match.group(2)))
+
+def get_game_shard(game, count):
+	# python's hash() of a string changes between runs, md5 does not
+	digest = hashlib.md5(str(int(game)).encode()).hexdigest()
+	return int(digest, 16) % count
+
+def in_shard(game, shard):
+	return shard is None or get_game_shard(game, shard[1]) == shard[0]
+
+def get_shard_games(games, shard):
+	return [game for game in games if in_shard(game, shard)]
+
+def get_shard_folder(output_folder, shard):
+	shard_folder = os.path.join(output_folder, SHARD_FOLDER.format(*shard))
+	os.makedirs(shard_folder, exist_ok=True)
+	return shard_folder
+
+def new_manifest(shard, script):
+	manifest = {
+		"shard": shard[0],
+		"shards": shard[1],
+		"script": script,
+		"files": {}
+	}
+	return manifest
+
+def add_file(manifest, filename, games, shard_games, rows):
+	manifest["files"][filename] = {
+		"games": sorted(int(game) for game in games),
+		"shard_games": sorted(int(game) for game in shard_games),
+		"rows": rows
+	}
+
+def save_manifest(shard_folder, manifest):
+	with open(os.path.join(shard_folder, MANIFEST_FILE), "w") as output:
+		output.write(json.dumps(manifest, indent=2))
+
+def load_manifests(shard_path):
+	manifests = {}
+	for name in sorted(os.listdir(shard_path)):
+		match = SHARD_PATTERN.match(name)
+		if match is None:
+			continue
+		manifest_path = os.path.join(shard_path, name, MANIFEST_FILE)
+		if not os.path.exists(manifest_path):
+			raise ValueError("Shard {} has no {}, it has not finished".format(name,
+				MANIFEST_FILE))
+		with open(manifest_path) as f:
+			manifests[name] = json.load(f)
+	if len(manifests) == 0:
+		raise ValueError("No shard folders in {}".format(shard_path))
+	return manifests
+
+## every shard of the same run must be there, have seen the same games
+## in the same files, and every game must be covered by exactly one shard
+def check_coverage(manifests):
+	first = list(manifests.values())[0]
+	count = first["shards"]
+	if any(m["shards"] != count or m["script"] != first["script"]
+		for m in manifests.values()):
+		raise ValueError("The shard folders are not from the same run")
+	missing = [i for i in range(count) if SHARD_FOLDER.format(i, count)
+		not in manifests]
+	if len(missing) != 0:
+		raise ValueError("Missing shards {} of {}".format(missing, count))
+	for (name, manifest) in manifests.items():
+		if manifest["files"].keys() != first["files"].keys():
+			raise ValueError("Shard {} has other files than {}".format(name,
+				SHARD_FOLDER.format(first["shard"], count)))
+		for (filename, info) in manifest["files"].items():
+			if info["games"] != first["files"][filename]["games"]:
+				raise ValueError("Shard {} has other games in {}".format(name,
+					filename))
+	for filename in first["files"]:
+		covered = {}
+		for manifest in manifests.values():
+			for game in manifest["files"][filename]["shard_games"]:
+				covered[game] = covered.get(game, 0) + 1
+		games = first["files"][filename]["games"]
+		missing = [game for game in games if covered.get(game, 0) == 0]
+		repeated = [game for game in covered if covered[game] > 1]
+		if len(missing) != 0 or len(repeated) != 0:
+			raise ValueError("Games {} of {} are not covered, games {} are "
+				"covered more than once".format(missing, filename, repeated))
+	print("All {} games of {} files covered by {} shards".format(
+		sum(len(info["games"]) for info in first["files"].values()),
+		len(first["files"]), count))
+
+def merge_file(shard_path, manifests, filename):
+	tables = []
+	for (name, manifest) in manifests.items():
+		if manifest["files"][filename]["rows"] == 0:
+			continue
+		tables.append(pd.read_csv(os.path.join(shard_path, name, filename),
+			index_col=0, float_precision="round_trip"))
+	if len(tables) == 0:
+		return pd.DataFrame()
+	# a single run appends the games in sorted order, the rows of a game
+	# keep their order
+	data = pd.concat(tables, ignore_index=True)
+	return data.sort_values(GAME_ID, kind="mergesort").reset_index(drop=True)
+
+def merge_shards(shard_path, output_folder):
+	manifests = load_manifests(shard_path)
+	check_coverage(manifests)
+	first = list(manifests.values())[0]
+	for filename in first["files"]:
+		data = merge_file(shard_path, manifests, filename)
+		name = list(manifests.keys())[0]
+		json_file = "{}.json".format(os.path.splitext(filename)[0])
+		if os.path.exists(os.path.join(shard_path, name, json_file)):
+			data.to_json(os.path.join(output_folder, json_file), orient="records",
+				indent=4)
+		data.to_csv(os.path.join(output_folder, filename))
+		print("Merged {} rows of {}".format(len(data), filename))
+
+def parse_args():
+	parser = argparse.ArgumentParser()
+	parser.add_argument(
+		"--shard_path", type=str,
+		help="specifies the folder containing the shard-<i>-of-<n> folders",
+		required=True)
+	parser.add_argument(
+		"--output_path", type=str, help="specifies the output folder path",
+		required=True)
+	return vars(parser.parse_args())
+
+def main():
+	args = parse_args()
+	print("Args: {}".format(args))
+	shard_path = os.path.abspath(args["shard_path"])
+	output_path = os.path.abspath(args["output_path"])
+
+	merge_shards(shard_path, output_path)
+	print("Merged files saved to {}".format(output_path))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,296 @@
+import argparse, os, re, json, fnmatch, hashlib, importlib.util, time, shutil
+
+# Runs find-ball-receiver -> compute-tracking-stats -> run-gmm (all window
+# configs) -> get-cluster as one pipeline. A stage is only run again when the
+# hash of its code, options, input files or upstream outputs has changed.
+# The stage scripts (and with them pandas, sklearn and scipy) are only loaded
+# when a stage runs.
+
+STATE_FILE = "pipeline-state.json"
+DATA_FILES = ["games.csv", "plays.csv", "week*.csv"]
+GMM_CONFIG_FILES = ["gmm-*-cfg.json"]
+HASH_BLOCK_SIZE = 1 << 20
+LOAD_SCRIPT_PATTERN = re.compile(r"(?<!def )load_script\((\w+|\"[^\"]+\")\)")
+
+DATA_PATH_KEY = "data_path"
+OUTPUT_PATH_KEY = "output_path"
+GMM_CONFIG_PATH_KEY = "gmm_config_path"
+GMM_OPTIONS_KEY = "gmm_options"
+CHUNK_SIZE_KEY = "cluster_chunk_size"
+CONFIG_KEYS = [DATA_PATH_KEY, OUTPUT_PATH_KEY, GMM_CONFIG_PATH_KEY,
+	GMM_OPTIONS_KEY, CHUNK_SIZE_KEY]
+REQUIRED_KEYS = [DATA_PATH_KEY, OUTPUT_PATH_KEY, GMM_CONFIG_PATH_KEY]
+CHUNK_SIZE = 100000
+
+def load_script(filename):
+	path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+	name = os.path.splitext(filename)[0].replace("-", "_")
+	spec = importlib.util.spec_from_file_location(name, path)
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module
+
+def run_receivers(config, folders):
+	script = load_script("find-ball-receiver.py")
+	script.compute_ball_receiver(config[DATA_PATH_KEY], folders["receivers"])
+
+def run_stats(config, folders):
+	script = load_script("compute-tracking-stats.py")
+	br_data = script.ball_receiver_data({"br_path": folders["receivers"]})
+	script.compute_stats(config[DATA_PATH_KEY], folders["stats"], br_data)
+
+def run_gmm(config, folders):
+	script = load_script("run-gmm-batch.py")
+	argv = ["--data_path", folders["stats"], "--config_path",
+		config[GMM_CONFIG_PATH_KEY], "--output_path", folders["models"]]
+	for (key, value) in config.get(GMM_OPTIONS_KEY, {}).items():
+		if value is not None:
+			argv += ["--{}".format(key), str(value)]
+	args = script.parse_args(argv)
+	script.run_batch(folders["stats"], config[GMM_CONFIG_PATH_KEY],
+		folders["models"], None, args)
+
+def run_cluster(config, folders):
+	script = load_script("get-cluster.py")
+	models = script.load_models(folders["models"], folders["clusters"])
+	script.get_cluster(models, folders["stats"],
+		config.get(CHUNK_SIZE_KEY, CHUNK_SIZE))
+
+# in dependency order, "inputs" are file patterns under a config path and
+# "options" are config keys, both part of the stage hash. The "scripts" are
+# hashed with every script they load
+STAGES = {
+	"receivers": {
+		"run": run_receivers,
+		"scripts": ["find-ball-receiver.py"],
+		"deps": [],
+		"inputs": [(DATA_PATH_KEY, DATA_FILES)],
+		"options": []
+	},
+	"stats": {
+		"run": run_stats,
+		"scripts": ["compute-tracking-stats.py"],
+		"deps": ["receivers"],
+		"inputs": [(DATA_PATH_KEY, DATA_FILES)],
+		"options": []
+	},
+	"models": {
+		"run": run_gmm,
+		"scripts": ["run-gmm-batch.py"],
+		"deps": ["stats"],
+		"inputs": [(GMM_CONFIG_PATH_KEY, GMM_CONFIG_FILES)],
+		"options": [GMM_OPTIONS_KEY]
+	},
+	"clusters": {
+		"run": run_cluster,
+		"scripts": ["get-cluster.py"],
+		"deps": ["stats", "models"],
+		"inputs": [],
+		"options": [CHUNK_SIZE_KEY]
+	}
+}
+
+def get_files(folder, patterns):
+	files = set()
+	for pattern in patterns:
+		files.update(fnmatch.filter(os.listdir(folder), pattern))
+	return sorted(files)
+
+def load_config(config_path):
+	with open(config_path) as f:
+		config = json.load(f)
+	unknown = [key for key in config if key not in CONFIG_KEYS]
+	missing = [key for key in REQUIRED_KEYS if key not in config]
+	if len(unknown) != 0 or len(missing) != 0:
+		raise ValueError("Unknown config keys {}, missing config keys {}".format(
+			unknown, missing))
+	# relative paths are relative to the config file
+	config_folder = os.path.dirname(os.path.abspath(config_path))
+	for key in [DATA_PATH_KEY, OUTPUT_PATH_KEY, GMM_CONFIG_PATH_KEY]:
+		config[key] = os.path.normpath(os.path.join(config_folder, config[key]))
+	for key in [DATA_PATH_KEY, GMM_CONFIG_PATH_KEY]:
+		if not os.path.isdir(config[key]):
+			raise ValueError("{} {} is not a folder".format(key, config[key]))
+	for (key, patterns) in [(DATA_PATH_KEY, DATA_FILES),
+		(GMM_CONFIG_PATH_KEY, GMM_CONFIG_FILES)]:
+		for pattern in patterns:
+			if len(get_files(config[key], [pattern])) == 0:
+				raise ValueError("No {} file in {}".format(pattern, config[key]))
+	if not isinstance(config.get(GMM_OPTIONS_KEY, {}), dict):
+		raise ValueError("{} should be an object".format(GMM_OPTIONS_KEY))
+	return config
+
+def get_folders(config):
+	return {name: os.path.join(config[OUTPUT_PATH_KEY], name)
+		for name in STAGES}
+
+def load_state(output_folder):
+	state_path = os.path.join(output_folder, STATE_FILE)
+	if not os.path.exists(state_path):
+		return {"stages": {}, "files": {}}
+	with open(state_path) as f:
+		return json.load(f)
+
+def save_state(output_folder, state):
+	with open(os.path.join(output_folder, STATE_FILE), "w") as f:
+		f.write(json.dumps(state, indent=2))
+
+## the content hash of a file is kept with its size and
+## modification time, and only computed again when they change
+def hash_file(path, state):
+	stat = os.stat(path)
+	cached = state["files"].get(path)
+	if cached is not None and cached["size"] == stat.st_size and \
+		cached["mtime"] == stat.st_mtime_ns:
+		return cached["hash"]
+	sha = hashlib.sha256()
+	with open(path, "rb") as f:
+		for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+			sha.update(block)
+	state["files"][path] = {"size": stat.st_size, "mtime": stat.st_mtime_ns,
+		"hash": sha.hexdigest()}
+	return sha.hexdigest()
+
+def hash_folder(folder, state):
+	if not os.path.isdir(folder):
+		return None
+	sha = hashlib.sha256()
+	for (root, dirs, files) in sorted(os.walk(folder)):
+		dirs.sort()
+		for f in sorted(files):
+			path = os.path.join(root, f)
+			sha.update(os.path.relpath(path, folder).encode())
+			sha.update(hash_file(path, state).encode())
+	return sha.hexdigest()
+
+## the scripts loaded through load_script, by name or by a module
+## constant holding the name, and the ones these load in turn
+def get_loaded_scripts(scripts, script_folder):
+	loaded = []
+	pending = list(scripts)
+	while len(pending) != 0:
+		script = pending.pop(0)
+		if script in loaded:
+			continue
+		loaded.append(script)
+		with open(os.path.join(script_folder, script)) as f:
+			source = f.read()
+		for name in LOAD_SCRIPT_PATTERN.findall(source):
+			if not name.startswith("\""):
+				match = re.search(r"^{} = (\"[^\"]+\")".format(name), source,
+					re.MULTILINE)
+				if match is None:
+					raise ValueError("Cannot find the script {} loaded by {}"
+						.format(name, script))
+				name = match.group(1)
+			pending.append(name.strip("\""))
+	return sorted(loaded)
+
+def hash_stage(name, config, state):
+	# None when an upstream stage has not run yet
+	stage = STAGES[name]
+	sha = hashlib.sha256(name.encode())
+	script_folder = os.path.dirname(os.path.abspath(__file__))
+	for script in get_loaded_scripts(stage["scripts"], script_folder):
+		sha.update(script.encode())
+		sha.update(hash_file(os.path.join(script_folder, script), state).encode())
+	for key in stage["options"]:
+		sha.update(json.dumps(config.get(key), sort_keys=True).encode())
+	for (key, patterns) in stage["inputs"]:
+		for f in get_files(config[key], patterns):
+			sha.update(f.encode())
+			sha.update(hash_file(os.path.join(config[key], f), state).encode())
+	for dep in stage["deps"]:
+		if dep not in state["stages"]:
+			return None
+		sha.update(state["stages"][dep]["output_hash"].encode())
+	return sha.hexdigest()
+
+def get_stage_status(name, config, folders, state):
+	saved = state["stages"].get(name)
+	if saved is None:
+		return "not run"
+	if saved["hash"] != hash_stage(name, config, state):
+		return "stale"
+	if saved["output_hash"] != hash_folder(folders[name], state):
+		return "output changed"
+	return "up to date"
+
+def get_stages(target):
+	stages = []
+	def add_stage(name):
+		for dep in STAGES[name]["deps"]:
+			add_stage(dep)
+		if name not in stages:
+			stages.append(name)
+	add_stage(target)
+	return [name for name in STAGES if name in stages]
+
+def run_pipeline(config, target, force):
+	folders = get_folders(config)
+	os.makedirs(config[OUTPUT_PATH_KEY], exist_ok=True)
+	state = load_state(config[OUTPUT_PATH_KEY])
+	for name in get_stages(target):
+		status = get_stage_status(name, config, folders, state)
+		if status == "up to date" and not force:
+			print("Stage {} is up to date, skipping".format(name))
+			continue
+		print("Running stage {} ({}) ...".format(name, status))
+		start = time.time()
+		# files left from an earlier run would be hashed and read downstream
+		if os.path.isdir(folders[name]):
+			shutil.rmtree(folders[name])
+		os.makedirs(folders[name])
+		STAGES[name]["run"](config, folders)
+		state["stages"][name] = {
+			"hash": hash_stage(name, config, state),
+			"output_hash": hash_folder(folders[name], state),
+			"seconds": time.time() - start
+		}
+		save_state(config[OUTPUT_PATH_KEY], state)
+		print("Stage {} done in {:.1f}s".format(name, time.time() - start))
+
+def print_status(config):
+	folders = get_folders(config)
+	state = load_state(config[OUTPUT_PATH_KEY])
+	stale = []
+	for name in STAGES:
+		status = get_stage_status(name, config, folders, state)
+		if status == "up to date" and \
+			any(dep in stale for dep in STAGES[name]["deps"]):
+			status = "stale upstream"
+		if status != "up to date":
+			stale.append(name)
+		print("{}: {}".format(name, status))
+
+def parse_args():
+	parser = argparse.ArgumentParser()
+	commands = ["run", "status", "validate"] + list(STAGES.keys())
+	parser.add_argument(
+		"command", type=str, choices=commands,
+		help="run runs all the stages, a stage name runs the stages up to it, "
+		"status shows which stages would run, validate checks the config")
+	parser.add_argument(
+		"--config_path", type=str, help="specifies the pipeline config file path",
+		required=True)
+	parser.add_argument(
+		"--force", action="store_true",
+		help="runs the stages even when they are up to date")
+	return vars(parser.parse_args())
+
+def main():
+	args = parse_args()
+	print("Args: {}".format(args))
+	config = load_config(os.path.abspath(args["config_path"]))
+
+	if args["command"] == "validate":
+		print("Config is valid: {}".format(config))
+	elif args["command"] == "status":
+		print_status(config)
+	else:
+		target = list(STAGES.keys())[-1] if args["command"] == "run" \
+			else args["command"]
+		run_pipeline(config, target, args["force"])
+
+if __name__ == "__main__":
+	main()
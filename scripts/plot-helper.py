@@ -1,34 +1,132 @@
 import pandas as pd
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plot
-import os, argparse
+from joblib import Parallel, delayed, effective_n_jobs
+import os, argparse, fnmatch, glob, json, time
 
 FIG_SIZE=(8,12)
 Y_LIM=(0, 500)
 
+IMAGE_FORMAT = "jpg"
+DEFAULT_KEY = "default"
+FILES_KEY = "files"
+FIG_SIZE_KEY = "fig_size"
+Y_LIM_KEY = "y_lim"
 
-def plot_graph(input_path, output_path):
+
+def plot_graph(input_path, output_path, figure, settings):
 	data = pd.read_csv(input_path)
-	axes = data.plot.bar(stacked=True, figsize=FIG_SIZE)
-	axes.set_ylim(Y_LIM[0], Y_LIM[1])
-	plot.savefig(output_path)
+	figure.clear()
+	figure.set_size_inches(settings[FIG_SIZE_KEY])
+	axes = figure.add_subplot()
+	data.plot.bar(stacked=True, ax=axes)
+	if settings[Y_LIM_KEY] is not None:
+		axes.set_ylim(settings[Y_LIM_KEY][0], settings[Y_LIM_KEY][1])
+	figure.savefig(output_path)
+
+def load_manifest(manifest_path):
+	if manifest_path is None:
+		return {}
+	with open(manifest_path, "r") as json_file:
+		return json.load(json_file)
+
+## the default settings of the manifest are applied first,
+## then the settings of every matching file pattern in order
+def get_settings(manifest, filename):
+	settings = {FIG_SIZE_KEY: FIG_SIZE, Y_LIM_KEY: Y_LIM}
+	settings.update(manifest.get(DEFAULT_KEY, {}))
+	files = manifest.get(FILES_KEY, {})
+	for pattern in files:
+		if fnmatch.fnmatch(filename, pattern):
+			settings.update(files[pattern])
+	return settings
+
+def is_up_to_date(input_path, output_path, manifest_path):
+	if not os.path.exists(output_path):
+		return False
+	input_time = os.path.getmtime(input_path)
+	if manifest_path is not None:
+		input_time = max(input_time, os.path.getmtime(manifest_path))
+	return os.path.getmtime(output_path) > input_time
+
+def get_input_files(data_path):
+	if os.path.isdir(data_path):
+		data_path = os.path.join(data_path, "*.csv")
+	return sorted(glob.glob(data_path))
+
+# every process draws its share of the csv files on one figure, cleared
+# between graphs, instead of creating a figure per file
+def render_graphs(graphs):
+	figure = plot.figure()
+	for (input_path, output_path, settings) in graphs:
+		plot_graph(input_path, output_path, figure, settings)
+	plot.close(figure)
+
+def plot_graphs(data_path, output_folder, manifest_path, jobs):
+	manifest = load_manifest(manifest_path)
+	graphs = []
+	skipped = 0
+	for input_path in get_input_files(data_path):
+		filename = os.path.basename(input_path)
+		output_path = os.path.join(output_folder, "{}.{}".format(
+			os.path.splitext(filename)[0], IMAGE_FORMAT))
+		if is_up_to_date(input_path, output_path, manifest_path):
+			skipped += 1
+			continue
+		graphs.append((input_path, output_path, get_settings(manifest,
+			filename)))
+
+	# the files are dealt out to the processes, so -1 has to be turned into
+	# the cpu count first
+	jobs = effective_n_jobs(jobs)
+	start = time.time()
+	Parallel(n_jobs=jobs)(delayed(render_graphs)(graphs[i::jobs])
+		for i in range(min(jobs, len(graphs))))
+	seconds = time.time() - start
+	print("Rendered {} charts in {:.2f}s, skipped {} up to date charts".format(
+		len(graphs), seconds, skipped))
 
 def parse_args():
 	parser = argparse.ArgumentParser()
 	parser.add_argument(
-		"--data_path", type=str, help="specifies the input csv file path",
+		"--data_path", type=str,
+		help="specifies the input csv file path, or a folder or glob of csv files",
 		required=True)
 	parser.add_argument(
-		"--output_path", type=str, help="specifies the output image file path",
+		"--output_path", type=str,
+		help="specifies the output image file path, or folder for many csv files",
 		required=True)
-	return vars(parser.parse_args())
+	parser.add_argument(
+		"--manifest_path", type=str,
+		help="specifies the json file with the plot settings of the csv files",
+		required=False)
+	parser.add_argument(
+		"--jobs", type=int, default=1,
+		help="specifies the number of processes rendering the charts (-1 uses "
+		"all cpus)", required=False)
+	args = vars(parser.parse_args())
+	if args["jobs"] == 0:
+		parser.error("--jobs should not be 0")
+	return args
 
 def main():
 	args = parse_args()
 	print("Args: {}".format(args))
 	data_path = os.path.abspath(args["data_path"])
 	output_path = os.path.abspath(args["output_path"])
+	manifest_path = None if args["manifest_path"] is None else \
+		os.path.abspath(args["manifest_path"])
+
+	if not os.path.isfile(data_path):
+		plot_graphs(data_path, output_path, manifest_path, args["jobs"])
+		print("Image files saved to {}".format(output_path))
+		return
 
-	plot_graph(data_path, output_path)
+	settings = get_settings(load_manifest(manifest_path),
+		os.path.basename(data_path))
+	render_graphs([(data_path, output_path, settings)])
 	print("Image file saved to {}".format(output_path))
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,112 @@
+import os, json, time, importlib.util
+
+# Progress of the long running scripts, written as json lines and optionally
+# as a metrics text file for the node exporter textfile collector. An update
+# only adds to the counters, the line is written at most every interval
+
+INTERVAL = 10
+MEMORY_SCRIPT = "memory-tracker.py"
+METRIC_PREFIX = "nfl_progress_"
+
+def load_script(filename):
+	path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+	name = os.path.splitext(filename)[0].replace("-", "_")
+	spec = importlib.util.spec_from_file_location(name, path)
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module
+
+mt = load_script(MEMORY_SCRIPT)
+
+## the first of the totals is the unit of the rate and the eta,
+## e.g. {"plays": 1200, "games": 16}
+def new_progress(script, totals, progress_path=None, metrics_path=None,
+	interval=INTERVAL):
+	progress = {
+		"script": script,
+		"stage": None,
+		"unit": list(totals.keys())[0],
+		"totals": dict(totals),
+		"done": {unit: 0 for unit in totals},
+		"progress_path": progress_path,
+		"metrics_path": metrics_path,
+		"interval": interval,
+		"start": time.time(),
+		"last": time.time()
+	}
+	return progress
+
+def get_state(progress):
+	unit = progress["unit"]
+	elapsed = time.time() - progress["start"]
+	rate = progress["done"][unit] / elapsed if elapsed > 0 else 0
+	left = progress["totals"][unit] - progress["done"][unit]
+	state = {
+		"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+		"script": progress["script"],
+		"stage": progress["stage"],
+		"elapsed_sec": round(elapsed, 1)
+	}
+	for u in progress["totals"]:
+		state["{}_done".format(u)] = progress["done"][u]
+		state["{}_total".format(u)] = progress["totals"][u]
+	state["{}_per_sec".format(unit)] = round(rate, 3)
+	state["eta_sec"] = round(max(left, 0) / rate, 1) if rate > 0 else None
+	state["rss_mb"] = round(mt.get_rss() / mt.MB, 1)
+	return state
+
+def write_metrics(progress, state):
+	labels = '{{script="{}"}}'.format(progress["script"])
+	lines = []
+	for u in progress["totals"]:
+		unit_labels = '{{script="{}",unit="{}"}}'.format(progress["script"], u)
+		lines.append("{}done{} {}".format(METRIC_PREFIX, unit_labels,
+			state["{}_done".format(u)]))
+		lines.append("{}total{} {}".format(METRIC_PREFIX, unit_labels,
+			state["{}_total".format(u)]))
+	lines.append("{}rate{} {}".format(METRIC_PREFIX, labels,
+		state["{}_per_sec".format(progress["unit"])]))
+	lines.append("{}eta_seconds{} {}".format(METRIC_PREFIX, labels,
+		"NaN" if state["eta_sec"] is None else state["eta_sec"]))
+	lines.append("{}rss_bytes{} {}".format(METRIC_PREFIX, labels,
+		int(state["rss_mb"] * mt.MB)))
+	# the collector must never read a half written file
+	temp_path = "{}.tmp".format(progress["metrics_path"])
+	with open(temp_path, "w") as output:
+		output.write("\n".join(lines) + "\n")
+	os.replace(temp_path, progress["metrics_path"])
+
+def report(progress):
+	progress["last"] = time.time()
+	state = get_state(progress)
+	line = json.dumps(state)
+	if progress["progress_path"] is None:
+		print(line)
+	else:
+		with open(progress["progress_path"], "a") as output:
+			output.write(line + "\n")
+	if progress["metrics_path"] is not None:
+		write_metrics(progress, state)
+
+def update(progress, **done):
+	if progress is None:
+		return
+	for unit in done:
+		progress["done"][unit] += done[unit]
+	if time.time() - progress["last"] >= progress["interval"]:
+		report(progress)
+
+def set_stage(progress, stage):
+	if progress is not None:
+		progress["stage"] = stage
+
+def add_totals(progress, **totals):
+	# for totals only known once a stage starts
+	if progress is None:
+		return
+	for unit in totals:
+		progress["totals"][unit] += totals[unit]
+
+def finish(progress):
+	if progress is not None:
+		report(progress)
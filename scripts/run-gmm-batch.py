@@ -0,0 +1,128 @@
+import argparse, os, json, importlib.util
+from joblib import Parallel, delayed
+
+# Runs run-gmm.py (and optionally get-cluster.py) for all the window configs
+# in a single process, the stats files are read once and shared by all configs
+
+CONFIGS = {
+	"gmm-after-pass-cfg.json": "after_pass",
+	"gmm-after-snap-cfg.json": "after_snap",
+	"gmm-before-pass-cfg.json": "before_pass",
+	"gmm-before-snap-cfg.json": "before_snap",
+	"gmm-between-snap-pass-cfg.json": "between_snap_pass",
+	"gmm-full-cfg.json": "full"
+}
+RUN_GMM_SCRIPT = "run-gmm.py"
+GET_CLUSTER_SCRIPT = "get-cluster.py"
+MODEL_FILE = "gmm.npz"
+
+def load_script(filename):
+	path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+	name = os.path.splitext(filename)[0].replace("-", "_")
+	spec = importlib.util.spec_from_file_location(name, path)
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module
+
+def load_configs(config_folder):
+	configs = {}
+	for cf in CONFIGS:
+		config_path = os.path.join(config_folder, cf)
+		if not os.path.exists(config_path):
+			print("Skipping missing config {}".format(config_path))
+			continue
+		with open(config_path) as f:
+			configs[CONFIGS[cf]] = json.load(f)
+	return configs
+
+def train_config(name, dataset, output_folder, config, options):
+	# runs in the worker processes as well, so the script is loaded here
+	gmm_script = load_script(RUN_GMM_SCRIPT)
+	print("Running config {} ...".format(name))
+	if options["metrics_path"] is not None:
+		# the configs run at the same time, each writes its own metrics file
+		(root, ext) = os.path.splitext(options["metrics_path"])
+		options = {**options, "metrics_path": "{}-{}{}".format(root, name, ext)}
+	tracker = gmm_script.mt.new_tracker(options["memory_profile"],
+		options["memory_limit"])
+	with gmm_script.mt.report_on_error(tracker, output_folder):
+		gmm_script.run_gmm_for_dataset(dataset, output_folder, config, options,
+			tracker)
+
+def cluster_config(cluster_script, stats_files, file_data, model_folder,
+	output_folder, config):
+	gmm = cluster_script.gm.load_model(os.path.join(model_folder, MODEL_FILE))
+	for (f, data) in zip(stats_files, file_data):
+		output_data = cluster_script.get_cluster_for_data(gmm, config, data)
+		output_data.to_csv(os.path.join(output_folder, f))
+	print("Clustering output saved to {}".format(output_folder))
+
+def run_batch(data_folder, config_folder, output_folder, cluster_folder, args):
+	gmm_script = load_script(RUN_GMM_SCRIPT)
+	configs = load_configs(config_folder)
+	options = gmm_script.get_options(args)
+	(stats_files, file_data) = gmm_script.load_stats(data_folder,
+		list(configs.values()))
+
+	tasks = []
+	for name in configs:
+		model_folder = os.path.join(output_folder, name)
+		os.makedirs(model_folder, exist_ok=True)
+		# the matrices are memory mapped when shared with worker processes
+		dataset = gmm_script.build_dataset(file_data, configs[name])
+		tasks.append(delayed(train_config)(name, dataset, model_folder,
+			configs[name], options))
+	Parallel(n_jobs=args["config_jobs"])(tasks)
+
+	if cluster_folder is None:
+		return
+	cluster_script = load_script(GET_CLUSTER_SCRIPT)
+	for name in configs:
+		print("Clustering config {} ...".format(name))
+		cluster_output = os.path.join(cluster_folder, name)
+		os.makedirs(cluster_output, exist_ok=True)
+		cluster_config(cluster_script, stats_files, file_data,
+			os.path.join(output_folder, name), cluster_output, configs[name])
+
+def get_parser(gmm_script):
+	parser = argparse.ArgumentParser()
+	parser.add_argument(
+		"--data_path", type=str, help="specifies the folder containing data files",
+		required=True)
+	parser.add_argument(
+		"--config_path", type=str, help="specifies the folder containing json config files",
+		required=True)
+	parser.add_argument(
+		"--output_path", type=str, help="specifies the output folder path",
+		required=True)
+	parser.add_argument(
+		"--cluster_path", type=str, help="specifies the cluster output folder path",
+		required=False)
+	parser.add_argument(
+		"--config_jobs", type=int, default=1,
+		help="specifies the number of configs run in parallel (-1 uses all cpus)",
+		required=False)
+	# the same fit options as run-gmm.py, they apply to each config
+	gmm_script.add_fit_arguments(parser)
+	return parser
+
+def parse_args(argv=None):
+	gmm_script = load_script(RUN_GMM_SCRIPT)
+	parser = get_parser(gmm_script)
+	args = vars(parser.parse_args(argv))
+	gmm_script.check_fit_arguments(parser, args)
+	return args
+
+def main():
+	args = parse_args()
+	print("Args: {}".format(args))
+	data_path = os.path.abspath(args["data_path"])
+	config_path = os.path.abspath(args["config_path"])
+	output_path = os.path.abspath(args["output_path"])
+	cluster_path = None if args["cluster_path"] is None else \
+		os.path.abspath(args["cluster_path"])
+
+	run_batch(data_path, config_path, output_path, cluster_path, args)
+
+if __name__ == "__main__":
+	main()
@@ -1,5 +1,10 @@
-import argparse, os, fnmatch, json, joblib
+import argparse, os, fnmatch, json, joblib, time, warnings, importlib.util
+import numpy as np
 import pandas as pd
+from joblib import Parallel, delayed
+from scipy import linalg
+from scipy.special import logsumexp
+from sklearn.exceptions import ConvergenceWarning
 from sklearn.mixture import GaussianMixture
 from sklearn.metrics import adjusted_rand_score
 
@@ -13,51 +18,272 @@ CLOSE_TO_BR_KEY = "close_to_br"
 SELECT_GROUP_KEY = "select_group_by"
 GROUP_BY = ["gameId", "playId"]
 MAX_COL = "closest_frames"
+STRATA_COL = "gameId"
+MAX_ITER = 1000
+BUDGET_ITER = 10
+LOWO_GMM_KEY = "gmm_lowo"
+INFLUENCE_REFIT = "refit"
+INFLUENCE_MARGINAL = "marginal"
+GROUP_SEARCH_EXHAUSTIVE = "exhaustive"
+GROUP_SEARCH_ADAPTIVE = "adaptive"
+MEMORY_SCRIPT = "memory-tracker.py"
+MODEL_SCRIPT = "gmm-model.py"
+PROGRESS_SCRIPT = "progress-reporter.py"
+STATS_SCRIPT = "compute-tracking-stats.py"
+ID_COLS = ["gameId", "playId", "nflId"]
+DATASET_KEYS = ["x", "missing", "strata", "plays", "selected"]
+# a week table and its matrix are in memory at the same time, a number
+# takes more bytes in the csv file than in the table
+READ_FACTOR = 2
+# a fit keeps copies of the rows (the fitted rows, the centered rows) and
+# of the rows x groups responsibilities and log probabilities
+FIT_FEATURE_COPIES = 2
+FIT_GROUP_COPIES = 4
+WORKER_MEMORY = 150 * 1024 * 1024
+# same defaults as GaussianMixture
+TOL = 1e-3
+REG_COVAR = 1e-6
+BOOTSTRAP_LEVEL = 0.95
+BOOTSTRAP_SEED = 0
 
-def run_gmm_for_g_and_k(file_data, g, k, skip_cols, only_closest, close_to_br):
-	file_count = len(file_data)
-	data = pd.DataFrame()
-	for j in range(file_count):
-		if j == k:
-			continue
-		data = data.append(file_data[j], ignore_index=True)
-
-	if only_closest == 1:
-		data = data.loc[data.groupby(GROUP_BY)[MAX_COL].idxmax()].reset_index(
-			drop=True)
-	elif len(close_to_br) != 0:
-		 data = data[data[CLOSE_TO_BR_KEY].isin(close_to_br)]
-
-	x = data.drop(skip_cols, axis = 1).dropna()
-	gmm = GaussianMixture(n_components=g,
-		covariance_type="full", max_iter=1000)
-	gmm = gmm.fit(x)
-
-	x_k = file_data[k].drop(skip_cols, axis = 1).dropna()
-	gmm_k = GaussianMixture(n_components=g,
-		covariance_type="full", max_iter=1000)
-	gmm_k = gmm_k.fit(x_k)
+def load_script(filename):
+	path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+	name = os.path.splitext(filename)[0].replace("-", "_")
+	spec = importlib.util.spec_from_file_location(name, path)
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module
+
+mt = load_script(MEMORY_SCRIPT)
+gm = load_script(MODEL_SCRIPT)
+pr = load_script(PROGRESS_SCRIPT)
+ct = load_script(STATS_SCRIPT)
+
+def new_gmm(g, init=None, max_iter=MAX_ITER):
+	if init is None:
+		return GaussianMixture(n_components=g,
+			covariance_type="full", max_iter=max_iter)
+	(weights, means, covariances) = init
+	precisions = np.array([linalg.inv(c) for c in covariances])
+	return GaussianMixture(n_components=g,
+		covariance_type="full", max_iter=max_iter, weights_init=weights,
+		means_init=means, precisions_init=precisions)
+
+def stratified_sample(strata, fraction, seed=0):
+	# keeps the same fraction of rows (at least one) from every stratum
+	rng = np.random.default_rng(seed)
+	order = rng.permutation(len(strata))
+	order = order[np.argsort(strata[order], kind="stable")]
+	_, starts, counts = np.unique(strata[order], return_index=True,
+		return_counts=True)
+	rank = np.arange(len(order)) - np.repeat(starts, counts)
+	keep = rank < np.ceil(fraction * np.repeat(counts, counts))
+	sample = np.zeros(len(strata), dtype=bool)
+	sample[order[keep]] = True
+	return sample
+
+def get_fit_budget(fit_options, elapsed=0):
+	# the part of the fit budget left after elapsed seconds of the fit
+	budget = fit_options["fit_budget"]
+	if budget is not None:
+		budget -= elapsed
+	if fit_options["deadline"] is not None:
+		remaining = fit_options["deadline"] - time.time()
+		budget = remaining if budget is None else min(budget, remaining)
+	return budget
+
+def run_em(gmm, x, budget):
+	# without a budget this is a plain fit, otherwise EM is run in short
+	# warm started rounds so that the fit can be stopped once over budget
+	if budget is None:
+		return (gmm.fit(x), False)
+	start = time.perf_counter()
+	max_iter = gmm.max_iter
+	n_iter = 0
+	timed_out = False
+	# already over budget, a single iteration gives a usable model
+	rounds = 1 if budget <= 0 else BUDGET_ITER
+	gmm.set_params(warm_start=True, max_iter=min(rounds, max_iter))
+	with warnings.catch_warnings():
+		warnings.simplefilter("ignore", ConvergenceWarning)
+		while True:
+			gmm = gmm.fit(x)
+			n_iter += gmm.n_iter_
+			if gmm.converged_ or n_iter >= max_iter:
+				break
+			if budget <= 0 or time.perf_counter() - start > budget:
+				timed_out = True
+				break
+	gmm.set_params(warm_start=False, max_iter=max_iter)
+	gmm.n_iter_ = n_iter
+	return (gmm, timed_out)
+
+def fit_gmm(g, x, init, strata, fit_options):
+	start = time.perf_counter()
+	refine = fit_options["refine"]
+	gmm = new_gmm(g, init)
+	sample_n_iter = 0
+	if refine is None:
+		(gmm, timed_out) = run_em(gmm, x, get_fit_budget(fit_options))
+	else:
+		(gmm, timed_out) = run_em(gmm,
+			x[stratified_sample(strata, refine["fraction"])],
+			get_fit_budget(fit_options))
+		sample_n_iter = gmm.n_iter_
+		# a few EM iterations on all the rows, starting from the subsample fit,
+		# within what is left of the budget
+		gmm = new_gmm(g, gmm_params(gmm), max_iter=refine["iterations"])
+		with warnings.catch_warnings():
+			warnings.simplefilter("ignore", ConvergenceWarning)
+			(gmm, refine_timed_out) = run_em(gmm, x, get_fit_budget(fit_options,
+				time.perf_counter() - start))
+		timed_out = timed_out or refine_timed_out
+	fit_info = {
+		"rows": len(x),
+		"seconds": time.perf_counter() - start,
+		"n_iter": gmm.n_iter_ + sample_n_iter,
+		"converged": bool(gmm.converged_),
+		"lower_bound": float(gmm.lower_bound_),
+		"timed_out": timed_out
+	}
+	if timed_out:
+		print("Fit for {} groups stopped after {} iterations, over budget".format(
+			g, fit_info["n_iter"]))
+	return (gmm, fit_info)
+
+def compute_precision_cholesky(covariances):
+	# same factorization as sklearn uses for "full" covariance
+	precisions_chol = []
+	for covariance in covariances:
+		cov_chol = linalg.cholesky(covariance, lower=True)
+		precisions_chol.append(linalg.solve_triangular(cov_chol,
+			np.eye(covariance.shape[0]), lower=True).T)
+	return np.array(precisions_chol)
+
+def gmm_params(gmm):
+	return (gmm.weights_, gmm.means_, gmm.covariances_)
+
+def split_component(gmm):
+	# initial parameters for g + 1 groups, the heaviest component is split
+	# in two along its principal axis
+	(weights, means, covariances) = gmm_params(gmm)
+	i = np.argmax(weights)
+	eigen_values, eigen_vectors = linalg.eigh(covariances[i])
+	offset = np.sqrt(eigen_values[-1]) * eigen_vectors[:, -1]
+	weights = np.append(weights, weights[i] / 2)
+	weights[i] = weights[i] / 2
+	means = np.vstack([means, means[i] + offset])
+	means[i] = means[i] - offset
+	covariances = np.concatenate([covariances, covariances[i:i + 1]])
+	return (weights, means, covariances)
+
+def marginal_params(gmm, columns, feature):
+	# marginal of a gaussian over a dropped feature is obtained by
+	# removing the feature from the mean and the covariance
+	keep = [i for i in range(len(columns)) if columns[i] != feature]
+	means = gmm.means_[:, keep]
+	covariances = gmm.covariances_[:, keep][:, :, keep]
+	return (gmm.weights_, means, covariances)
+
+def marginalize_gmm(gmm, columns, feature):
+	(weights, means, covariances) = marginal_params(gmm, columns, feature)
+	marginal = GaussianMixture(n_components=gmm.n_components,
+		covariance_type="full")
+	marginal.weights_ = weights
+	marginal.means_ = means
+	marginal.covariances_ = covariances
+	marginal.precisions_cholesky_ = compute_precision_cholesky(covariances)
+	marginal.precisions_ = np.array([p @ p.T
+		for p in marginal.precisions_cholesky_])
+	marginal.converged_ = gmm.converged_
+	marginal.n_iter_ = gmm.n_iter_
+	marginal.lower_bound_ = gmm.lower_bound_
+	marginal.n_features_in_ = means.shape[1]
+	return marginal
+
+def build_dataset(file_data, config):
+	# assemble the column selected stats of all weeks once, the leave one
+	# week out train and test sets are then selected from this matrix with
+	# boolean row masks. The selection copies the rows, so each fit still
+	# holds its own train or test matrix (see get_fit_memory)
+	data = pd.concat(file_data, ignore_index=True)
+	weeks = np.concatenate([np.full(len(file_data[k]), k)
+		for k in range(len(file_data))])
+	if config[ONLY_CLOSEST_KEY] == 1:
+		selected = np.zeros(len(data), dtype=bool)
+		selected[data.groupby(GROUP_BY)[MAX_COL].idxmax().values] = True
+	elif len(config[CLOSE_TO_BR_KEY]) != 0:
+		selected = data[CLOSE_TO_BR_KEY].isin(config[CLOSE_TO_BR_KEY]).values
+	else:
+		selected = np.ones(len(data), dtype=bool)
+	# the stats may be computed for some features only, skipped columns
+	# that are not there are already left out
+	columns = list(data.columns.drop(config[SKIP_COLS_KEY], errors="ignore"))
+	x = np.ascontiguousarray(data[columns].to_numpy(dtype=np.float64))
+	dataset = {
+		"x": x,
+		"missing": np.isnan(x),
+		"weeks": weeks,
+		"strata": data[STRATA_COL].values,
+		"plays": data.groupby(GROUP_BY, sort=False).ngroup().values,
+		"selected": selected,
+		"columns": columns,
+		"week_count": len(file_data)
+	}
+	return dataset
+
+def get_features(dataset, mask, feature=None):
+	columns = dataset["columns"]
+	if feature is None:
+		keep = slice(None)
+	else:
+		keep = [i for i in range(len(columns)) if columns[i] != feature]
+		columns = [columns[i] for i in keep]
+	# same as dropna on the selected columns
+	mask = mask & ~dataset["missing"][:, keep].any(axis=1)
+	x = dataset["x"][mask]
+	if feature is not None:
+		x = x[:, keep]
+	return (x, columns, mask)
+
+def run_gmm_for_g_and_k(dataset, g, k, fit_options, feature=None, init=None,
+	init_k=None):
+	lowo = dataset["weeks"] == k
+	x, _, rows = get_features(dataset, ~lowo & dataset["selected"], feature)
+	(gmm, fit_info) = fit_gmm(g, x, init, dataset["strata"][rows], fit_options)
+
+	x_k, _, rows_k = get_features(dataset, lowo, feature)
+	(gmm_k, fit_info_k) = fit_gmm(g, x_k, init_k, dataset["strata"][rows_k],
+		fit_options)
 
 	# predict cluster for the k week on both models
 	y = gmm.predict(x_k)
 	y_k = gmm_k.predict(x_k)
 
 	ari = adjusted_rand_score(y, y_k)
-	# return the computed ari and gmm (skipping k)
-	return (ari, gmm)
+	pr.update(fit_options["progress"], fits=2)
+	fits = {
+		"lowo_index": k,
+		"train": fit_info,
+		"lowo": fit_info_k
+	}
+	# return the computed ari, gmm (skipping k), gmm (only k) and fit details
+	return (ari, gmm, gmm_k, fits)
 
-def run_gmm_for_group_count(file_data, group_count, config):
+def run_gmm_for_group_count(dataset, group_count, fit_options):
 	print("Running gmm for group count {}".format(group_count))
 	ari = []
 	gmm = []
-	file_count = len(file_data)
-	for k in range(file_count):
+	gmm_lowo = []
+	fits = []
+	for k in range(dataset["week_count"]):
 		# print("Running gmm by leaving out index {}".format(k))
-		(ari_k, gmm_k) = run_gmm_for_g_and_k(file_data, group_count, k,
-			config[SKIP_COLS_KEY], config[ONLY_CLOSEST_KEY],
-			config[CLOSE_TO_BR_KEY])
+		(ari_k, gmm_k, gmm_lowo_k, fits_k) = run_gmm_for_g_and_k(dataset,
+			group_count, k, fit_options)
 		ari.append(ari_k)
 		gmm.append(gmm_k)
+		gmm_lowo.append(gmm_lowo_k)
+		fits.append(fits_k)
 
 	ari_max_index = ari.index(max(ari))
 	ari_max = ari[ari_max_index]
@@ -67,34 +293,126 @@ def run_gmm_for_group_count(file_data, group_count, config):
 		"lowo_index": ari_max_index,
 		"max_ari": ari_max,
 		"total_ari": ari_sum,
-		"gmm": gmm_max
+		"gmm": gmm_max,
+		LOWO_GMM_KEY: gmm_lowo[ari_max_index],
+		"fits": fits
+	}
+	return result
+
+def subsample_dataset(dataset, weeks, fraction, seed=0):
+	# whole plays are drawn, so that the defenders of a play are kept together
+	rng = np.random.default_rng(seed)
+	play_codes = get_play_codes(dataset)
+	drawn = rng.random(play_codes.max() + 1 if len(play_codes) != 0 else 0) < \
+		fraction
+	mask = np.isin(dataset["weeks"], weeks) & drawn[play_codes]
+	subsample = {k: dataset[k][mask]
+		for k in ["x", "missing", "weeks", "strata", "plays", "selected"]}
+	subsample["columns"] = dataset["columns"]
+	subsample["week_count"] = dataset["week_count"]
+	return subsample
+
+def get_screen_weeks(dataset, group_search):
+	return sorted(set(np.linspace(0, dataset["week_count"] - 1,
+		group_search["weeks"]).round().astype(int).tolist()))
+
+def screen_group_counts(dataset, group_min, group_max, group_search,
+	fit_options):
+	# leave one week out over a few weeks of a row subsample, the fits for
+	# g + 1 groups are started by splitting a component of the g group fits
+	# of the same week. The split starts stay within the screening, the
+	# promoted group counts are fitted from scratch as in the exhaustive search
+	weeks = get_screen_weeks(dataset, group_search)
+	subsample = subsample_dataset(dataset, weeks, group_search["fraction"])
+	print("Screening group counts on {} rows of weeks {}".format(
+		len(subsample["weeks"]), weeks))
+	screening = {}
+	previous = None
+	for g in range(group_min, group_max + 1):
+		ari = []
+		current = []
+		fits = []
+		for i in range(len(weeks)):
+			init = None if previous is None else split_component(previous[i][0])
+			init_k = None if previous is None else \
+				split_component(previous[i][1])
+			(ari_k, gmm, gmm_k, fits_k) = run_gmm_for_g_and_k(subsample, g,
+				weeks[i], fit_options, init=init, init_k=init_k)
+			ari.append(ari_k)
+			current.append((gmm, gmm_k))
+			fits.append(fits_k)
+		previous = current
+		max_index = ari.index(max(ari))
+		screening[g] = {
+			"lowo_index": weeks[max_index],
+			"max_ari": ari[max_index],
+			"total_ari": sum(ari),
+			"fits": fits
+		}
+		print("Screened group count {}, max ari: {}".format(g, max(ari)))
+	result = {
+		"weeks": weeks,
+		"fraction": group_search["fraction"],
+		"group_data": screening
 	}
 	return result
 
-def run_gmm_feature_influence(file_data, group_count, skip_lowo, config):
-	print("Running gmm for group {}, skipping lowo index: {}".format(
-		group_count, skip_lowo))
-	if len(file_data) == 0:
+def run_gmm_without_feature(dataset, group_count, skip_lowo, feature,
+	gmm_result, fit_options):
+	# warm start the reduced fits from the full feature models,
+	# marginalized over the skipped feature
+	columns = dataset["columns"]
+	init = marginal_params(gmm_result["gmm"], columns, feature)
+	init_k = marginal_params(gmm_result[LOWO_GMM_KEY], columns, feature)
+	ari_c, gmm_c, _, fits_c = run_gmm_for_g_and_k(dataset, group_count,
+		skip_lowo, fit_options, feature=feature, init=init, init_k=init_k)
+	return (ari_c, gmm_c, fits_c)
+
+def score_gmm_without_feature(dataset, skip_lowo, feature, gmm_result):
+	# estimate the influence without refitting, by scoring the left out
+	# week on both models marginalized over the skipped feature
+	columns = dataset["columns"]
+	gmm_c = marginalize_gmm(gmm_result["gmm"], columns, feature)
+	gmm_k = marginalize_gmm(gmm_result[LOWO_GMM_KEY], columns, feature)
+	x_k, _, _ = get_features(dataset, dataset["weeks"] == skip_lowo, feature)
+	ari_c = adjusted_rand_score(gmm_c.predict(x_k), gmm_k.predict(x_k))
+	return (ari_c, gmm_c, None)
+
+def run_gmm_feature_influence(dataset, group_count, gmm_result, fit_options,
+	mode=INFLUENCE_REFIT, jobs=1):
+	skip_lowo = gmm_result["lowo_index"]
+	print("Running gmm for group {}, skipping lowo index: {}, mode: {}".format(
+		group_count, skip_lowo, mode))
+	if dataset["week_count"] == 0:
 		return
-	global_skip_cols = config[SKIP_COLS_KEY]
-	cols = set(file_data[0].columns) - set(global_skip_cols)
+	cols = sorted(dataset["columns"])
+	if mode == INFLUENCE_MARGINAL:
+		results = [score_gmm_without_feature(dataset, skip_lowo, c,
+			gmm_result) for c in cols]
+	else:
+		# the workers have their own copy of the progress, it is updated
+		# here once they are done
+		results = Parallel(n_jobs=jobs, verbose=5)(
+			delayed(run_gmm_without_feature)(dataset, group_count, skip_lowo,
+				c, gmm_result, {**fit_options, "progress": None}) for c in cols)
+		pr.update(fit_options["progress"], fits=2 * len(cols))
 	result = {}
-	for c in cols:
-		print("Skipping feature {}".format(c))
-		skip_cols = global_skip_cols + [c]
-		ari_c, gmm_c = run_gmm_for_g_and_k(file_data, group_count, skip_lowo,
-			skip_cols, config[ONLY_CLOSEST_KEY], config[CLOSE_TO_BR_KEY])
+	for (c, (ari_c, gmm_c, fits_c)) in zip(cols, results):
 		result[c] = {
 			"ari": ari_c,
-			"gmm": gmm_c
+			"gmm": gmm_c,
+			"fits": fits_c
 		}
 	return result
 
-def save_results(output_folder, gmms, selected_g, influence_aris, config):
+def save_results(output_folder, gmms, selected_g, influence_aris, config,
+	influence_mode=INFLUENCE_REFIT, screening=None, refine_check=None,
+	fit_summary=None, bootstrap=None):
 	groups = sorted(gmms.keys())
 	gmm_result = {}
 	for g in groups:
-		gmm_result[g] = {k: gmms[g][k] for k in gmms[g].keys() - {"gmm"}}
+		gmm_result[g] = {k: gmms[g][k] for k in gmms[g].keys() -
+			{"gmm", LOWO_GMM_KEY}}
 	selected_result = { **gmm_result[selected_g] }
 	selected_result["group_count"] = selected_g
 	selected_result["selection_key"] = config[SELECT_GROUP_KEY]
@@ -105,7 +423,8 @@ def save_results(output_folder, gmms, selected_g, influence_aris, config):
 	influence_result = {
 		"group_count": selected_g,
 		"lowo_index": selected_result["lowo_index"],
-		"ari_with_all_features": selected_result["max_ari"]
+		"ari_with_all_features": selected_result["max_ari"],
+		"mode": influence_mode
 	}
 	feature_result = {}
 	influences = {}
@@ -116,6 +435,8 @@ def save_results(output_folder, gmms, selected_g, influence_aris, config):
 			"influence": ari_with_all - ari,
 			"ari": ari
 		}
+		if influence_aris[feature]["fits"] is not None:
+			influences[feature]["fits"] = influence_aris[feature]["fits"]
 	feature_result = dict(sorted(influences.items(),
 		key=lambda item: item[1]["influence"], reverse=True))
 	influence_result["feature_data"] = feature_result
@@ -124,6 +445,14 @@ def save_results(output_folder, gmms, selected_g, influence_aris, config):
 		"selected_group": selected_result,
 		"feature_influence": influence_result
 	}
+	if screening is not None:
+		output["group_screening"] = screening
+	if refine_check is not None:
+		output["refine_check"] = refine_check
+	if fit_summary is not None:
+		output["fit_summary"] = fit_summary
+	if bootstrap is not None:
+		output["bootstrap"] = bootstrap
 
 	output_path = os.path.join(output_folder, "results.json")
 	json_data = json.dumps(output, indent=2)
@@ -141,29 +470,466 @@ def save_results(output_folder, gmms, selected_g, influence_aris, config):
 	gmm_path = os.path.join(output_folder, "gmm.joblib")
 	joblib.dump(selected_gmm, gmm_path)
 	print("GMM model saved to {}".format(gmm_path))
+	model_path = os.path.join(output_folder, gm.MODEL_FILE)
+	gm.export_gmm(selected_gmm, model_path)
+	print("GMM parameters saved to {}".format(model_path))
 
-def run_gmm(data_folder, output_folder, config):
+## only the columns kept by one of the configs are read, a config
+## feature missing from the stats files fails the run
+def get_used_columns(input_file, configs):
+	header = pd.read_csv(input_file, nrows=0).columns
+	keep = ID_COLS + GROUP_BY + [MAX_COL, CLOSE_TO_BR_KEY, STRATA_COL]
+	for config in configs:
+		missing = [col for col in ct.get_feature_columns()
+			if col not in config[SKIP_COLS_KEY] and col not in header]
+		if len(missing) != 0:
+			raise ValueError("{} has no {} columns, the stats were computed "
+				"without them".format(os.path.basename(input_file), missing))
+		keep += list(header.drop(config[SKIP_COLS_KEY], errors="ignore"))
+	return [col for col in header if col in keep]
+
+def load_stats(data_folder, configs):
 	stats_files = fnmatch.filter(os.listdir(data_folder), "{}*.csv".format(
 		STATS_PREFIX))
 	file_data = []
 	for sf in stats_files:
 		print("Working on file {} ...".format(sf))
 		input_file = os.path.join(data_folder, sf)
-		stats_data = pd.read_csv(input_file)
+		stats_data = pd.read_csv(input_file, usecols=get_used_columns(input_file,
+			configs))
 		file_data.append(stats_data)
+	return (stats_files, file_data)
 
-	gmm_groups = {}
-	for g in range(config["group_min"], config["group_max"] + 1):
-		result = run_gmm_for_group_count(file_data, g, config)
-		gmm_groups[g] = result
+## with a memory limit the weeks are read one at a time, only with the
+## used columns, and every week table is freed once turned into rows of
+## the dataset matrices
+def load_dataset(data_folder, config, tracker):
+	stats_files = fnmatch.filter(os.listdir(data_folder), "{}*.csv".format(
+		STATS_PREFIX))
+	parts = []
+	for sf in stats_files:
+		print("Working on file {} ...".format(sf))
+		input_file = os.path.join(data_folder, sf)
+		mt.check_budget(tracker, os.path.getsize(input_file) * READ_FACTOR,
+			"Reading {}".format(sf))
+		stats_data = pd.read_csv(input_file, usecols=get_used_columns(
+			input_file, [config]))
+		parts.append(build_dataset([stats_data], config))
+		del stats_data
+		if parts[-1]["columns"] != parts[0]["columns"]:
+			raise ValueError("{} has other columns than {}".format(sf,
+				stats_files[0]))
+	mt.check_budget(tracker, sum(p[k].nbytes for p in parts
+		for k in DATASET_KEYS), "Joining the weeks")
+	dataset = {k: np.concatenate([p[k] for p in parts]) for k in DATASET_KEYS}
+	dataset["weeks"] = np.concatenate([np.full(len(parts[k]["x"]), k)
+		for k in range(len(parts))])
+	dataset["columns"] = parts[0]["columns"]
+	dataset["week_count"] = len(parts)
+	return dataset
+
+def run_gmm(data_folder, output_folder, config, options):
+	tracker = mt.new_tracker(options["memory_profile"], options["memory_limit"])
+	with mt.report_on_error(tracker, output_folder):
+		if options["memory_limit"] is not None:
+			with mt.stage(tracker, "load_dataset"):
+				dataset = load_dataset(data_folder, config, tracker)
+		else:
+			with mt.stage(tracker, "load_stats"):
+				(_, file_data) = load_stats(data_folder, [config])
+			with mt.stage(tracker, "build_dataset"):
+				dataset = build_dataset(file_data, config)
+				del file_data
+		run_gmm_for_dataset(dataset, output_folder, config, options, tracker)
+
+def get_fit_memory(dataset, group_count):
+	(rows, features) = dataset["x"].shape
+	return rows * dataset["x"].itemsize * (FIT_FEATURE_COPIES * features +
+		FIT_GROUP_COPIES * group_count)
+
+def get_jobs(dataset, config, options, tracker):
+	# fails before fitting when a single fit does not fit under the memory
+	# limit, and lowers the parallel jobs to the ones that do
+	jobs = options["jobs"]
+	if tracker["limit"] is None:
+		return jobs
+	fit_memory = get_fit_memory(dataset, config["group_max"])
+	mt.check_budget(tracker, fit_memory, "A gmm fit of {} rows and {} "
+		"groups".format(len(dataset["x"]), config["group_max"]))
+	max_jobs = max(1, int(mt.get_budget(tracker) // (fit_memory +
+		WORKER_MEMORY)))
+	if joblib.effective_n_jobs(jobs) > max_jobs:
+		print("Lowering jobs from {} to {} to stay under the memory limit".format(
+			joblib.effective_n_jobs(jobs), max_jobs))
+		jobs = max_jobs
+	return jobs
+
+def compare_refined_fit(dataset, group_count, k, fit_options):
+	# fits the leave one week out pair both ways to see what the subsample
+	# and refine fit costs in terms of ari
+	refine = fit_options["refine"]
+	start = time.perf_counter()
+	(refined_ari, refined_gmm, _, refined_fits) = run_gmm_for_g_and_k(dataset,
+		group_count, k, fit_options)
+	refined_seconds = time.perf_counter() - start
+	start = time.perf_counter()
+	(full_ari, full_gmm, _, full_fits) = run_gmm_for_g_and_k(dataset,
+		group_count, k, {**fit_options, "refine": None})
+	full_seconds = time.perf_counter() - start
+	x_k, _, _ = get_features(dataset, dataset["weeks"] == k)
+	result = {
+		"group_count": group_count,
+		"lowo_index": k,
+		"fraction": refine["fraction"],
+		"iterations": refine["iterations"],
+		"refined_ari": refined_ari,
+		"full_ari": full_ari,
+		"ari_difference": full_ari - refined_ari,
+		"model_agreement_ari": adjusted_rand_score(refined_gmm.predict(x_k),
+			full_gmm.predict(x_k)),
+		"refined_seconds": refined_seconds,
+		"full_seconds": full_seconds,
+		"fits": [refined_fits, full_fits]
+	}
+	print("Refined fit ari: {}, full fit ari: {}".format(refined_ari, full_ari))
+	return result
 
+def get_fit_count(dataset, config, options):
+	# the fits planned for the run, the total of the progress
+	groups = config["group_max"] - config["group_min"] + 1
+	group_search = options["group_search"]
+	count = 0
+	if group_search is not None:
+		count += groups * len(get_screen_weeks(dataset, group_search)) * 2
+		groups = min(groups, group_search["top"])
+	count += groups * dataset["week_count"] * 2
+	count += options["bootstrap"] * groups * 2
+	if options["influence_mode"] == INFLUENCE_REFIT:
+		count += len(dataset["columns"]) * 2
+	if options["refine"] is not None:
+		count += 4
+	return count
+
+def new_progress(dataset, output_folder, config, options):
+	script = "{} {}".format(os.path.basename(__file__),
+		os.path.basename(output_folder))
+	return pr.new_progress(script, {"fits": get_fit_count(dataset, config,
+		options)}, options["progress_path"], options["metrics_path"])
+
+def get_model(gmm):
+	model = {
+		"weights": gmm.weights_,
+		"means": gmm.means_,
+		"precisions_cholesky": gmm.precisions_cholesky_,
+		"features": None
+	}
+	return model
+
+def weighted_m_step(x, resp):
+	# the responsibilities are already multiplied by the row weights
+	nk = resp.sum(axis=0) + 10 * np.finfo(resp.dtype).eps
+	means = np.dot(resp.T, x) / nk[:, np.newaxis]
+	covariances = np.empty((len(nk), x.shape[1], x.shape[1]))
+	for k in range(len(nk)):
+		diff = x - means[k]
+		covariances[k] = np.dot(resp[:, k] * diff.T, diff) / nk[k]
+		covariances[k].flat[::x.shape[1] + 1] += REG_COVAR
+	model = {
+		"weights": nk / nk.sum(),
+		"means": means,
+		"precisions_cholesky": compute_precision_cholesky(covariances),
+		"features": None
+	}
+	return model
+
+## EM with a weight per row, started from a fitted model, the weights of
+## a bootstrap replicate are how many times every row was drawn
+def fit_weighted_gmm(gmm, x, w, deadline):
+	x = x[w > 0]
+	w = w[w > 0].astype(np.float64)
+	model = get_model(gmm)
+	lower_bound = -np.inf
+	converged = False
+	for n_iter in range(1, MAX_ITER + 1):
+		weighted = gm.estimate_weighted_log_prob(model, x)
+		log_norm = logsumexp(weighted, axis=1)
+		resp = np.exp(weighted - log_norm[:, np.newaxis]) * w[:, np.newaxis]
+		model = weighted_m_step(x, resp)
+		previous = lower_bound
+		lower_bound = np.dot(w, log_norm) / w.sum()
+		converged = abs(lower_bound - previous) < TOL
+		if converged or time.time() > deadline:
+			break
+	return (model, n_iter, converged)
+
+def get_play_codes(dataset):
+	# the play ids restart in every week when loaded under a memory limit
+	(_, codes) = np.unique(np.stack([dataset["weeks"], dataset["plays"]],
+		axis=1), axis=0, return_inverse=True)
+	return codes.ravel()
+
+def run_bootstrap_replicate(dataset, group_result, play_counts, play_codes,
+	deadline):
+	# the leave one week out pair of a group count refitted on a resample
+	# of the plays, the ari is taken over the resampled left out rows
+	if time.time() > deadline:
+		return None
+	start = time.perf_counter()
+	w = play_counts[play_codes]
+	k = group_result["lowo_index"]
+	lowo = dataset["weeks"] == k
+	x, _, rows = get_features(dataset, ~lowo & dataset["selected"])
+	(model, n_iter, converged) = fit_weighted_gmm(group_result["gmm"], x,
+		w[rows], deadline)
+	x_k, _, rows_k = get_features(dataset, lowo)
+	(model_k, n_iter_k, converged_k) = fit_weighted_gmm(
+		group_result[LOWO_GMM_KEY], x_k, w[rows_k], deadline)
+	w_k = w[rows_k]
+	x_k = x_k[w_k > 0]
+	w_k = w_k[w_k > 0]
+	ari = adjusted_rand_score(np.repeat(gm.predict(model, x_k), w_k),
+		np.repeat(gm.predict(model_k, x_k), w_k))
+	replicate = {
+		"ari": ari,
+		"seconds": time.perf_counter() - start,
+		"n_iter": n_iter + n_iter_k,
+		"converged": bool(converged and converged_k)
+	}
+	return replicate
+
+## the plays are drawn with replacement as multinomial counts, for all the
+## replicates at once, and the same draws are used for every group count.
+## The replicates run in parallel round robin over the group counts until
+## the time budget is spent
+def run_bootstrap(dataset, gmm_groups, options, jobs, progress=None):
+	start = time.time()
+	deadline = np.inf if options["bootstrap_time_budget"] is None else \
+		start + options["bootstrap_time_budget"]
+	replicates = options["bootstrap"]
+	play_codes = get_play_codes(dataset)
+	play_count = play_codes.max() + 1
+	rng = np.random.default_rng(BOOTSTRAP_SEED)
+	counts = rng.multinomial(play_count, np.full(play_count, 1 / play_count),
+		size=replicates)
+	groups = sorted(gmm_groups)
+	print("Bootstrapping {} replicates of {} plays for group counts {}".format(
+		replicates, play_count, groups))
+	tasks = [(g, b) for b in range(replicates) for g in groups]
+	results = Parallel(n_jobs=jobs, verbose=5)(
+		delayed(run_bootstrap_replicate)(dataset, {key: gmm_groups[g][key]
+			for key in ["lowo_index", "gmm", LOWO_GMM_KEY]}, counts[b],
+			play_codes, deadline) for (g, b) in tasks)
+	tail = (1 - BOOTSTRAP_LEVEL) / 2 * 100
+	for g in groups:
+		done = [r for ((group, _), r) in zip(tasks, results)
+			if group == g and r is not None]
+		aris = [r["ari"] for r in done]
+		gmm_groups[g]["bootstrap"] = {
+			"replicates": len(done),
+			"lowo_index": gmm_groups[g]["lowo_index"],
+			"ari_mean": float(np.mean(aris)) if len(aris) != 0 else None,
+			"ari_std": float(np.std(aris)) if len(aris) != 0 else None,
+			"ari_interval": [float(v) for v in np.percentile(aris,
+				[tail, 100 - tail])] if len(aris) != 0 else None,
+			"level": BOOTSTRAP_LEVEL,
+			"not_converged": sum(1 for r in done if not r["converged"]),
+			"fit_seconds": sum(r["seconds"] for r in done)
+		}
+		print("Bootstrap group count {}: ari {} interval {} ({} replicates)"
+			.format(g, gmm_groups[g]["bootstrap"]["ari_mean"],
+			gmm_groups[g]["bootstrap"]["ari_interval"], len(done)))
+	completed = sum(1 for r in results if r is not None)
+	pr.update(progress, fits=2 * completed)
+	summary = {
+		"replicates": replicates,
+		"group_counts": groups,
+		"scheduled": len(tasks),
+		"completed": completed,
+		"plays": int(play_count),
+		"level": BOOTSTRAP_LEVEL,
+		"time_budget": options["bootstrap_time_budget"],
+		"wall_seconds": time.time() - start
+	}
+	if completed < len(tasks):
+		print("Bootstrap stopped after {} of {} replicates of the group counts, "
+			"over budget".format(completed, len(tasks)))
+	return summary
+
+def get_fit_options(options, start, progress=None):
+	fit_options = {
+		"progress": progress,
+		"refine": options["refine"],
+		"fit_budget": options["fit_time_budget"],
+		"deadline": None if options["time_budget"] is None else \
+			start + options["time_budget"]
+	}
+	return fit_options
+
+def summarize_fits(fit_lists, options, start):
+	fit_infos = [f for fits in fit_lists for lowo_fits in fits
+		for f in [lowo_fits["train"], lowo_fits["lowo"]]]
+	summary = {
+		"fit_count": len(fit_infos),
+		"fit_seconds": sum(f["seconds"] for f in fit_infos),
+		"max_fit_seconds": max([f["seconds"] for f in fit_infos], default=0),
+		"total_iterations": sum(f["n_iter"] for f in fit_infos),
+		"not_converged": sum(1 for f in fit_infos if not f["converged"]),
+		"timed_out": sum(1 for f in fit_infos if f["timed_out"]),
+		"time_budget": options["time_budget"],
+		"fit_time_budget": options["fit_time_budget"],
+		"wall_seconds": time.time() - start
+	}
+	print("Fits: {}, not converged: {}, timed out: {}".format(
+		summary["fit_count"], summary["not_converged"], summary["timed_out"]))
+	return summary
+
+def run_gmm_for_dataset(dataset, output_folder, config, options,
+	tracker=None):
+	start = time.time()
+	if tracker is None:
+		tracker = mt.new_tracker(options["memory_profile"],
+			options["memory_limit"])
+	jobs = get_jobs(dataset, config, options, tracker)
+	progress = new_progress(dataset, output_folder, config, options)
+	fit_options = get_fit_options(options, start, progress)
 	group_key = config[SELECT_GROUP_KEY]
+	group_search = options["group_search"]
+	groups = range(config["group_min"], config["group_max"] + 1)
+	screening = None
+	if group_search is not None:
+		pr.set_stage(progress, "screen_group_counts")
+		with mt.stage(tracker, "screen_group_counts"):
+			screening = screen_group_counts(dataset,
+				config["group_min"], config["group_max"], group_search,
+				fit_options)
+		groups = sorted(groups, key=lambda g: screening["group_data"][g][
+			group_key], reverse=True)[:group_search["top"]]
+		screening["promoted"] = sorted(groups)
+
+	gmm_groups = {}
+	pr.set_stage(progress, "group_counts")
+	with mt.stage(tracker, "group_counts"):
+		for g in sorted(groups):
+			gmm_groups[g] = run_gmm_for_group_count(dataset, g, fit_options)
+
 	selected_group = max(gmm_groups, key= lambda x: gmm_groups[x][group_key])
-	gmm_influence_result = run_gmm_feature_influence(file_data, selected_group,
-		gmm_groups[selected_group]["lowo_index"], config)
+	pr.set_stage(progress, "feature_influence")
+	with mt.stage(tracker, "feature_influence"):
+		gmm_influence_result = run_gmm_feature_influence(dataset,
+			selected_group, gmm_groups[selected_group], fit_options,
+			mode=options["influence_mode"], jobs=jobs)
+	refine_check = None
+	if options["refine"] is not None:
+		pr.set_stage(progress, "refine_check")
+		with mt.stage(tracker, "refine_check"):
+			refine_check = compare_refined_fit(dataset, selected_group,
+				gmm_groups[selected_group]["lowo_index"], fit_options)
+	bootstrap = None
+	if options["bootstrap"] > 0:
+		pr.set_stage(progress, "bootstrap")
+		with mt.stage(tracker, "bootstrap"):
+			bootstrap = run_bootstrap(dataset, gmm_groups, options, jobs,
+				progress)
+	# models are fitted on the bare matrix, keep the column names on the saved
+	# model so that it validates the stats columns passed for clustering
+	gmm_groups[selected_group]["gmm"].feature_names_in_ = np.asarray(
+		dataset["columns"], dtype=object)
+
+	fit_lists = [gmm_groups[g]["fits"] for g in gmm_groups]
+	fit_lists += [[gmm_influence_result[c]["fits"]]
+		for c in gmm_influence_result if gmm_influence_result[c]["fits"]]
+	if screening is not None:
+		fit_lists += [screening["group_data"][g]["fits"]
+			for g in screening["group_data"]]
+	if refine_check is not None:
+		fit_lists.append(refine_check["fits"])
+	fit_summary = summarize_fits(fit_lists, options, start)
 
 	save_results(output_folder, gmm_groups, selected_group,
-		gmm_influence_result, config)
+		gmm_influence_result, config, influence_mode=options["influence_mode"],
+		screening=screening, refine_check=refine_check, fit_summary=fit_summary,
+		bootstrap=bootstrap)
+	if options["memory_profile"]:
+		mt.save_report(tracker, output_folder)
+	pr.finish(progress)
+
+## the fit options, shared with run-gmm-batch.py so that both scripts take
+## the same values
+def add_fit_arguments(parser):
+	parser.add_argument(
+		"--influence_mode", type=str, default=INFLUENCE_REFIT,
+		choices=[INFLUENCE_REFIT, INFLUENCE_MARGINAL],
+		help="specifies how feature influence is computed, {} warm starts the "
+		"reduced fits, {} rescores the marginalized models without refitting"
+		.format(INFLUENCE_REFIT, INFLUENCE_MARGINAL), required=False)
+	parser.add_argument(
+		"--jobs", type=int, default=1,
+		help="specifies the number of parallel jobs (-1 uses all cpus)",
+		required=False)
+	parser.add_argument(
+		"--group_search", type=str, default=GROUP_SEARCH_EXHAUSTIVE,
+		choices=[GROUP_SEARCH_EXHAUSTIVE, GROUP_SEARCH_ADAPTIVE],
+		help="specifies how the group count is searched, {} screens the group "
+		"counts on a subsample and fully evaluates only the best ones".format(
+		GROUP_SEARCH_ADAPTIVE), required=False)
+	parser.add_argument(
+		"--screen_weeks", type=int, default=3,
+		help="specifies the number of weeks left out while screening",
+		required=False)
+	parser.add_argument(
+		"--screen_fraction", type=float, default=0.25,
+		help="specifies the fraction of rows used while screening",
+		required=False)
+	parser.add_argument(
+		"--screen_top", type=int, default=3,
+		help="specifies the number of screened group counts fully evaluated",
+		required=False)
+	parser.add_argument(
+		"--refine_fraction", type=float,
+		help="specifies the fraction of rows, sampled per game, each gmm is "
+		"first fitted on before being refined on all the rows", required=False)
+	parser.add_argument(
+		"--refine_iterations", type=int, default=10,
+		help="specifies the number of EM iterations used to refine",
+		required=False)
+	parser.add_argument(
+		"--time_budget", type=float,
+		help="specifies the time budget in seconds for all the fits of a run, "
+		"fits still running past it are stopped", required=False)
+	parser.add_argument(
+		"--fit_time_budget", type=float,
+		help="specifies the time budget in seconds of each single fit",
+		required=False)
+	parser.add_argument(
+		"--memory_limit", type=float,
+		help="specifies the memory limit in MB, the weeks are then read one at "
+		"a time and the parallel jobs lowered to stay under it", required=False)
+	parser.add_argument(
+		"--memory_profile", action="store_true",
+		help="traces the allocations of every stage and saves memory.json",
+		required=False)
+	parser.add_argument(
+		"--bootstrap", type=int, default=0,
+		help="specifies the number of bootstrap replicates, the plays are "
+		"resampled and the leave one week out pair of every group count is "
+		"refitted to get an ari interval", required=False)
+	parser.add_argument(
+		"--bootstrap_time_budget", type=float,
+		help="specifies the time budget in seconds of the bootstrap, the "
+		"replicates not started past it are left out", required=False)
+	parser.add_argument(
+		"--progress_path", type=str,
+		help="specifies the file the progress json lines are appended to, "
+		"they are printed when not given", required=False)
+	parser.add_argument(
+		"--metrics_path", type=str,
+		help="specifies the metrics text file the progress is also written to, "
+		"for the node exporter textfile collector", required=False)
+
+def check_fit_arguments(parser, args):
+	if args["group_search"] == GROUP_SEARCH_ADAPTIVE and args["screen_weeks"] < 2:
+		parser.error("--screen_weeks should be at least 2, a single week leaves "
+			"no weeks to train on")
 
 def parse_args():
 	parser = argparse.ArgumentParser()
@@ -176,7 +942,46 @@ def parse_args():
 	parser.add_argument(
 		"--output_path", type=str, help="specifies the output folder path",
 		required=True)
-	return vars(parser.parse_args())
+	add_fit_arguments(parser)
+	args = vars(parser.parse_args())
+	check_fit_arguments(parser, args)
+	return args
+
+def get_group_search(args):
+	if args["group_search"] != GROUP_SEARCH_ADAPTIVE:
+		return None
+	group_search = {
+		"weeks": args["screen_weeks"],
+		"fraction": args["screen_fraction"],
+		"top": args["screen_top"]
+	}
+	return group_search
+
+def get_refine(args):
+	if args["refine_fraction"] is None:
+		return None
+	refine = {
+		"fraction": args["refine_fraction"],
+		"iterations": args["refine_iterations"]
+	}
+	return refine
+
+def get_options(args):
+	options = {
+		"influence_mode": args["influence_mode"],
+		"jobs": args["jobs"],
+		"group_search": get_group_search(args),
+		"refine": get_refine(args),
+		"time_budget": args["time_budget"],
+		"fit_time_budget": args["fit_time_budget"],
+		"memory_limit": args["memory_limit"],
+		"memory_profile": args["memory_profile"],
+		"bootstrap": args["bootstrap"],
+		"bootstrap_time_budget": args["bootstrap_time_budget"],
+		"progress_path": args["progress_path"],
+		"metrics_path": args["metrics_path"]
+	}
+	return options
 
 def main():
 	args = parse_args()
@@ -188,6 +993,7 @@ def main():
 		config = json.load(f)
 	print("Config: {}".format(config))
 
-	run_gmm(data_path, output_path, config)
+	run_gmm(data_path, output_path, config, get_options(args))
 
-main()
+if __name__ == "__main__":
+	main()
@@ -1,6 +1,10 @@
 import pandas as pd
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plot
-import os, argparse, json, math
+from joblib import Parallel, delayed, effective_n_jobs
+import os, argparse, json, math, time
 
 X_FILE = "x.csv"
 Y_PASS_FILE = "y-passResult.csv"
@@ -32,7 +36,53 @@ def normalize(data, normalizer):
 
 	return data
 
-def plot_and_save_graph(data, output_folder, x_col, y_col, config):
+## every column is factorized once, the labels are decoded
+## on the unique values only
+def get_codes(data, normalizer):
+	codes = {}
+	labels = {}
+	for col in data.columns:
+		col_codes, uniques = pd.factorize(data[col])
+		codes[col] = col_codes
+		labels[col] = normalize(pd.DataFrame({col: uniques}), normalizer)[col]
+	return codes, labels
+
+## the rows are counted once per distinct combination of codes,
+## the x / y tables are then summed from these combinations
+def count_combinations(codes, columns):
+	# the codes of a row are packed in one integer key (code + 1 as missing
+	# values are -1), unless the key could overflow
+	sizes = [int(codes[col].max()) + 2 for col in columns]
+	if np.prod(sizes, dtype=float) >= 2 ** 62:
+		matrix = np.column_stack([codes[col] for col in columns])
+		return np.unique(matrix, axis=0, return_counts=True)
+	strides = np.cumprod([1] + sizes[:-1])
+	keys = np.zeros(len(codes[columns[0]]), dtype=np.int64)
+	for (col, stride) in zip(columns, strides):
+		keys += (codes[col].astype(np.int64) + 1) * stride
+	keys, counts = np.unique(keys, return_counts=True)
+	combinations = np.column_stack([(keys // stride) % size - 1
+		for (stride, size) in zip(strides, sizes)])
+	return combinations, counts
+
+def get_crosstab(combinations, counts, x, y, x_labels, y_labels):
+	# missing values have the code -1 and are left out, as in groupby
+	valid = (combinations[:, x] >= 0) & (combinations[:, y] >= 0)
+	x_count = len(x_labels)
+	y_count = len(y_labels)
+	table = np.bincount(combinations[valid, x] * y_count +
+		combinations[valid, y], weights=counts[valid],
+		minlength=x_count * y_count).reshape(x_count, y_count)
+	data = pd.DataFrame(table, index=pd.Index(x_labels),
+		columns=pd.Index(y_labels))
+	data = data.loc[data.sum(axis=1) > 0, data.sum(axis=0) > 0]
+	# same table as pivot_table, missing pairs are NaN
+	data = data.where(data > 0).sort_index().sort_index(axis=1)
+	if not data.isnull().values.any():
+		data = data.astype(np.int64)
+	return data
+
+def plot_and_save_graph(data, output_folder, x_col, y_col, config, figure):
 	plot_data = data
 	plot_indices = plot_data.index.values.tolist()
 	found_indices = list(set(plot_indices) & set(config[IGNORE_X_KEY]))
@@ -41,16 +91,25 @@ def plot_and_save_graph(data, output_folder, x_col, y_col, config):
 	found_indices = list(set(plot_indices) & set(config[IGNORE_Y_KEY]))
 	plot_data = plot_data.drop(found_indices, axis = 1)
 
-	axes = plot_data.plot.bar(stacked=True)
+	figure.clear()
+	axes = figure.add_subplot()
+	plot_data.plot.bar(stacked=True, ax=axes)
 	plot.xticks(rotation=0, size=5)
 
 	prefix = "{}-{}".format(x_col, y_col)
 	output_path = os.path.join(output_folder, "{}.jpg".format(prefix))
-	plot.savefig(output_path)
+	figure.savefig(output_path)
 	output_path = os.path.join(output_folder, "{}.csv".format(prefix))
 	data.to_csv(output_path)
 
-def visualize(data_folder, output_folder, config_path):
+## a worker clears and reuses a single figure for all its charts
+def render_charts(charts, output_folder, config):
+	figure = plot.figure()
+	for (data, x_col, y_col) in charts:
+		plot_and_save_graph(data, output_folder, x_col, y_col, config, figure)
+	plot.close(figure)
+
+def visualize(data_folder, output_folder, config_path, jobs):
 	normalize_path = os.path.join(data_folder, NORMALIZE_FILE)
 	with open(normalize_path, "r") as json_file:
 		normalize_map = json.load(json_file)
@@ -59,19 +118,34 @@ def visualize(data_folder, output_folder, config_path):
 
 	x_path = os.path.join(data_folder, X_FILE)
 	x_data = pd.read_csv(x_path)
+	y_data = {}
 	for y in Y_FILES:
 		y_path = os.path.join(data_folder, y)
-		y_data = pd.read_csv(y_path)
+		y_data[y] = pd.read_csv(y_path)
+	data = x_data.join(list(y_data.values()))
+	columns = list(data.columns)
+	codes, labels = get_codes(data, normalize_map)
+	combinations, counts = count_combinations(codes, columns)
+	charts = []
+	for y in Y_FILES:
 		for x_col in x_data.columns:
-			for y_col in y_data.columns:
-				data = x_data.join(y_data)
-				data = data.groupby([x_col, y_col]).size().reset_index(
-					name="count")
-				data = normalize(data, normalize_map)
-				pivot_data = data.pivot_table(values="count", index=x_col,
-					columns=y_col)
-				plot_and_save_graph(pivot_data, output_folder, x_col, y_col,
-					config)
+			for y_col in y_data[y].columns:
+				pivot_data = get_crosstab(combinations, counts,
+					columns.index(x_col), columns.index(y_col), labels[x_col],
+					labels[y_col])
+				pivot_data.index.name = x_col
+				pivot_data.columns.name = y_col
+				charts.append((pivot_data, x_col, y_col))
+
+	# -1 and the other negative values are resolved to a number of processes
+	# before the charts are split between them
+	jobs = effective_n_jobs(jobs)
+	start = time.time()
+	Parallel(n_jobs=jobs)(delayed(render_charts)(charts[i::jobs], output_folder,
+		config) for i in range(min(jobs, len(charts))))
+	seconds = time.time() - start
+	print("Rendered {} charts in {:.2f}s ({:.1f} charts/sec)".format(
+		len(charts), seconds, len(charts) / seconds if seconds > 0 else 0))
 
 def parse_args():
 	parser = argparse.ArgumentParser()
@@ -84,7 +158,14 @@ def parse_args():
 	parser.add_argument(
 		"--config_path", type=str, help="specifies the config file path",
 		required=True)
-	return vars(parser.parse_args())
+	parser.add_argument(
+		"--jobs", type=int, default=1,
+		help="specifies the number of processes rendering the charts (-1 uses "
+		"all cpus)", required=False)
+	args = vars(parser.parse_args())
+	if args["jobs"] == 0:
+		parser.error("--jobs should not be 0")
+	return args
 
 def main():
 	args = parse_args()
@@ -93,7 +174,8 @@ def main():
 	output_path = os.path.abspath(args["output_path"])
 	config_path = os.path.abspath(args["config_path"])
 
-	visualize(data_path, output_path, config_path)
+	visualize(data_path, output_path, config_path, args["jobs"])
 	print("Images and csv files saved to {}".format(output_path))
 
-main()
+if __name__ == "__main__":
+	main()